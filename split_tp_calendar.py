@@ -28,11 +28,49 @@ Du ba om:
 
 from __future__ import annotations
 from dateutil import tz
+from dateutil.rrule import rruleset, rrulestr
 from ics import Calendar, Event
+from ics.grammar.parse import ContentLine
 import requests
-from typing import Dict, Optional, Tuple, List, Any
-from dataclasses import dataclass
+from typing import Dict, FrozenSet, Optional, Tuple, List, Any, Iterable, Iterator
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+import bisect
+import cProfile
+import gzip
+import contextlib
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
+import pickle
+import pstats
+import random
 import re
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import zstandard  # valgfri: pip install zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import numpy as np  # valgfri: pip install numpy (VECTORIZED)
+except ImportError:
+    np = None
+
+try:
+    import tomllib  # Python 3.11+
+except ImportError:
+    try:
+        import tomli as tomllib  # valgfri: pip install tomli (eldre Python)
+    except ImportError:
+        tomllib = None
 
 # =============================================================================
 # BRUKERINNSTILLINGER (ALT DU SKAL ENDRE STÅR HER)
@@ -55,6 +93,17 @@ USER_SETTINGS = {
     # -------------------------------------------------------------------------
     "ICS_URL": "https://tp.educloud.no/ntnu/timeplan/ical.php?sem=26v&id%5B0%5D=88047&type=student",
 
+    # Nedlastingen stoppes (FAIL_FAST) hvis en feed er større enn dette.
+    "DOWNLOAD_MAX_MB": 50,
+
+    # Flere TP-feeder (valgfritt), f.eks. fag-feeder i tillegg til din egen.
+    # Samme forelesning fra flere feeder (samme fag, start, slutt og rom) tas
+    # bare med én gang når DEDUP_ACROSS_FEEDS=True.
+    "EXTRA_ICS_FEEDS": [
+        # {"id": "tdt4100-fag", "url": "https://tp.educloud.no/ntnu/timeplan/ical.php?..."},
+    ],
+    "DEDUP_ACROSS_FEEDS": True,
+
     # -------------------------------------------------------------------------
     # 4) FAG SOM SKAL SPLITTES UT (fagkode -> kortkode + filnavn)
     #
@@ -147,6 +196,147 @@ USER_SETTINGS = {
     # 9) PRETTY SUMMARY (kort oppsummering helt til slutt)
     # -------------------------------------------------------------------------
     "PRETTY_SUMMARY": True,
+
+    # -------------------------------------------------------------------------
+    # 10) SNAPSHOT / REPLAY (raskt å teste TYPE_RULES og EVENT_FILTERS)
+    #
+    # - SNAPSHOT_ENABLED: lagrer rå TP-feed + ferdig parsede events i
+    #   SNAPSHOT_DIR etter hver nedlasting
+    # - REPLAY_FROM_SNAPSHOT: kjører hele transform/filter/rapport fra siste
+    #   snapshot (ingen nedlasting, ingen ny parsing). Fint sammen med DRY_RUN.
+    # -------------------------------------------------------------------------
+    "SNAPSHOT_ENABLED": True,
+    "SNAPSHOT_DIR": "tp_snapshot",
+    "REPLAY_FROM_SNAPSHOT": False,
+
+    # -------------------------------------------------------------------------
+    # 11) OUTPUT-MOTOR (du kan la denne stå)
+    #
+    # - "stream": skriver hvert event rett til fila mens feeden behandles
+    #   (output-kalenderne bygges ikke opp i minnet; selve feeden og
+    #   rapport-/konfliktdata holdes fortsatt i minnet)
+    # - "ics": gammel variant via ics.Calendar + serialize()
+    # -------------------------------------------------------------------------
+    "OUTPUT_ENGINE": "stream",
+
+    # -------------------------------------------------------------------------
+    # 12) HORISONT-VINDUER (valgfritt): mindre filer å abonnere på
+    #
+    # Hvert vindu gir én ekstra fil per fag med bare events i et rullerende
+    # tidsvindu rundt "nå", f.eks. "00.naa.ics" = siste 2 uker + neste 8 uker.
+    # Google Kalender henter hele fila ved hver oppdatering, så mindre fil =
+    # raskere og billigere.
+    #
+    # HORIZON_ARCHIVE_ID: hvis satt (f.eks. "arkiv"), skrives også
+    # "00.arkiv.ics" med events som er ferdige før det tidligste vinduet.
+    # -------------------------------------------------------------------------
+    "HORIZON_WINDOWS": [
+        # {"id": "naa", "past_days": 14, "future_days": 56},
+    ],
+    "HORIZON_ARCHIVE_ID": "",
+
+    # -------------------------------------------------------------------------
+    # 13) OPPTATT-KALENDER (valgfritt): én liten fil med bare "Opptatt"-blokker
+    #
+    # Slår sammen alle beholdte events (på tvers av fag) til minimale
+    # opptatt-blokker. Fin å dele med andre uten å dele alle fagkalenderne.
+    # "" = av, f.eks. "opptatt.ics" = på.
+    # -------------------------------------------------------------------------
+    "FREEBUSY_FILE": "",
+    "FREEBUSY_TITLE": "Opptatt",
+
+    # -------------------------------------------------------------------------
+    # 14) KOMPRIMERING + MANIFEST (valgfritt, for servere/synk-jobber)
+    #
+    # - OUTPUT_COMPRESS: skriv ferdigkomprimerte søsken ved siden av hver
+    #   .ics-fil: "gz" -> 00.ics.gz, "zst" -> 00.ics.zst (krever zstandard)
+    # - OUTPUT_MANIFEST_FILE: JSON med sha256 + størrelse per fil. Filer med
+    #   samme innhold som forrige kjøring skrives ikke på nytt.
+    # -------------------------------------------------------------------------
+    "OUTPUT_COMPRESS": [],                 # f.eks. ["gz"] eller ["gz", "zst"]
+    "OUTPUT_MANIFEST_FILE": "",            # f.eks. "manifest.json"
+
+    # -------------------------------------------------------------------------
+    # 15) PROFILERING (valgfritt): hvilke regler/regex koster tid?
+    #
+    # - PROFILING: måler tid + antall evalueringer per TYPE_RULES-mønster,
+    #   per EVENT_FILTERS-regel og per klausul, og viser de dyreste i rapporten
+    # - PROFILE_PSTATS_FILE: hvis satt, kjøres hele scriptet under cProfile og
+    #   statistikken dumpes hit (åpne med: python -m pstats <fil>)
+    # -------------------------------------------------------------------------
+    "PROFILING": False,
+    "PROFILE_PSTATS_FILE": "",             # f.eks. "split_tp.pstats"
+    "PROFILE_SHOW_MAX": 10,
+
+    # -------------------------------------------------------------------------
+    # 16) FERDIGKOMPILERTE REGLER (du kan la denne stå)
+    #
+    # Validerte regler, regex, HH:MM-tider og fag-matcher lagres i
+    # RULE_CACHE_DIR, nøklet på hash av innstillingene. Uendrede innstillinger
+    # hopper da over validering og kompilering ved oppstart.
+    #
+    # Tips: én installert kopi av scriptet kan brukes med mange configfiler:
+    #   python split_tp_calendar.py --config min_timeplan.toml
+    # (configfila inneholder de samme nøklene som USER_SETTINGS, som TOML eller JSON;
+    #  nøkler som mangler i fila hentes herfra)
+    # -------------------------------------------------------------------------
+    "COMPILED_RULES": True,
+    "RULE_CACHE_DIR": ".split_tp_cache",
+
+    # -------------------------------------------------------------------------
+    # 17) GJENTAKENDE EVENTS (RRULE/EXDATE) – du kan la denne stå
+    #
+    # Serier skrives som én VEVENT med RRULE (ikke utvidet). Bare når vi må se
+    # på enkelt-forekomster (filter på weekday/tid, konflikter, horisont-vinduer)
+    # utvides serien, og da bare innenfor dette vinduet rundt "nå".
+    # -------------------------------------------------------------------------
+    "RECURRENCE_PAST_DAYS": 180,
+    "RECURRENCE_FUTURE_DAYS": 365,
+
+    # -------------------------------------------------------------------------
+    # 18) METRIKKER FOR PLANLAGTE KJØRINGER (valgfritt)
+    #
+    # Hvis satt, skrives måletall for kjøringen (nedlastingstid, bytes, antall
+    # events, treff per filterregel, konflikter, tid per steg, filer skrevet/
+    # uendret) i Prometheus tekstformat til denne fila – også når kjøringen
+    # feiler. Pek node_exporter sin textfile collector mot mappen.
+    # -------------------------------------------------------------------------
+    "METRICS_FILE": "",                    # f.eks. "metrics/split_tp.prom"
+
+    # -------------------------------------------------------------------------
+    # 19) VEKTORISERT TID/OVERLAPP (du kan la denne stå; krever numpy)
+    #
+    # For store feeder (mange fag/hele institutter) kan weekday/start_time/
+    # end_time-filtrene og konfliktsjekken regnes på hele kolonner med numpy
+    # i stedet for event for event. Resultatet er nøyaktig det samme.
+    # - "auto": brukes når numpy finnes og det er minst VECTORIZE_MIN_EVENTS
+    #   events (tidsfiltre) / VECTORIZE_CONFLICTS_MIN_EVENTS forekomster
+    #   (konfliktsjekk, serier medregnet)
+    # - "on" / "off": alltid / aldri
+    # Konfliktsjekken i ren Python er allerede rask, så numpy lønner seg først
+    # ved mye større kalendere enn for filtrene. Se hvor grensene går på din
+    # maskin med:
+    #   python split_tp_calendar.py --benchmark-vektor
+    # -------------------------------------------------------------------------
+    "VECTORIZED": "auto",
+    "VECTORIZE_MIN_EVENTS": 3000,
+    "VECTORIZE_CONFLICTS_MIN_EVENTS": 30000,
+
+    # -------------------------------------------------------------------------
+    # 20) ROMBELEGG (valgfritt)
+    #
+    # - ROOM_REPORT: rapporten viser dobbeltbookede rom (to beholdte events i
+    #   samme rom samtidig) og timer i bruk per rom per uke
+    # - ROOM_WEEK_HOURS: timer per uke som regnes som 100 % belegg
+    # - ROOM_FREE_QUERIES: "er rommet ledig da?" – besvares i rapporten
+    #   (tid i lokal tid, "ÅÅÅÅ-MM-DD TT:MM"; "building" er valgfri)
+    # -------------------------------------------------------------------------
+    "ROOM_REPORT": False,
+    "ROOM_WEEK_HOURS": 40,
+    "ROOM_FREE_QUERIES": [
+        # {"room": "R9", "at": "2026-01-12 10:15"},
+        # {"room": "A2-107", "building": "Realfagbygget", "at": "2026-01-13 14:00"},
+    ],
 }
 # =============================================================================
 
@@ -157,31 +347,148 @@ USER_SETTINGS = {
 
 
 # =====================
-# Intern CONFIG (bygges fra USER_SETTINGS)
+# Intern CONFIG (bygges fra USER_SETTINGS, eventuelt overstyrt av --config)
 # =====================
-CONFIG = {
-    "DRY_RUN": bool(USER_SETTINGS["DRY_RUN"]),
-    "FAIL_FAST": bool(USER_SETTINGS["FAIL_FAST"]),
-    "LOCAL_TIMEZONE": str(USER_SETTINGS["LOCAL_TIMEZONE"]),
-    "ICS_URL": str(USER_SETTINGS["ICS_URL"]),
-    "COURSES": dict(USER_SETTINGS["COURSES"]),
-    "TYPE_RULES": dict(USER_SETTINGS["TYPE_RULES"]),
-    "DEFAULT_TYPE": str(USER_SETTINGS["DEFAULT_TYPE"]),
-    "MAZEMAP_URL_REGEX": str(USER_SETTINGS["MAZEMAP_URL_REGEX"]),
-    "ENABLE_EVENT_FILTERS": bool(USER_SETTINGS["ENABLE_EVENT_FILTERS"]),
-    "EVENT_FILTERS": list(USER_SETTINGS["EVENT_FILTERS"]),
-    "CONFLICT_DETECTOR_ENABLED": bool(USER_SETTINGS["CONFLICT_DETECTOR_ENABLED"]),
-    "CONFLICTS_SHOW_MAX": int(USER_SETTINGS["CONFLICTS_SHOW_MAX"]),
-    "PRETTY_SUMMARY": bool(USER_SETTINGS["PRETTY_SUMMARY"]),
-}
+def bygg_config(settings: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "DRY_RUN": bool(settings["DRY_RUN"]),
+        "FAIL_FAST": bool(settings["FAIL_FAST"]),
+        "LOCAL_TIMEZONE": str(settings["LOCAL_TIMEZONE"]),
+        "ICS_URL": str(settings["ICS_URL"]),
+        "DOWNLOAD_MAX_MB": float(settings["DOWNLOAD_MAX_MB"]),
+        "EXTRA_ICS_FEEDS": list(settings["EXTRA_ICS_FEEDS"]),
+        "DEDUP_ACROSS_FEEDS": bool(settings["DEDUP_ACROSS_FEEDS"]),
+        "COURSES": dict(settings["COURSES"]),
+        "TYPE_RULES": dict(settings["TYPE_RULES"]),
+        "DEFAULT_TYPE": str(settings["DEFAULT_TYPE"]),
+        "MAZEMAP_URL_REGEX": str(settings["MAZEMAP_URL_REGEX"]),
+        "ENABLE_EVENT_FILTERS": bool(settings["ENABLE_EVENT_FILTERS"]),
+        "EVENT_FILTERS": list(settings["EVENT_FILTERS"]),
+        "CONFLICT_DETECTOR_ENABLED": bool(settings["CONFLICT_DETECTOR_ENABLED"]),
+        "CONFLICTS_SHOW_MAX": int(settings["CONFLICTS_SHOW_MAX"]),
+        "PRETTY_SUMMARY": bool(settings["PRETTY_SUMMARY"]),
+        "SNAPSHOT_ENABLED": bool(settings["SNAPSHOT_ENABLED"]),
+        "SNAPSHOT_DIR": str(settings["SNAPSHOT_DIR"]),
+        "REPLAY_FROM_SNAPSHOT": bool(settings["REPLAY_FROM_SNAPSHOT"]),
+        "OUTPUT_ENGINE": str(settings["OUTPUT_ENGINE"]),
+        "HORIZON_WINDOWS": list(settings["HORIZON_WINDOWS"]),
+        "HORIZON_ARCHIVE_ID": str(settings["HORIZON_ARCHIVE_ID"]),
+        "FREEBUSY_FILE": str(settings["FREEBUSY_FILE"]),
+        "FREEBUSY_TITLE": str(settings["FREEBUSY_TITLE"]),
+        "OUTPUT_COMPRESS": list(settings["OUTPUT_COMPRESS"]),
+        "OUTPUT_MANIFEST_FILE": str(settings["OUTPUT_MANIFEST_FILE"]),
+        "PROFILING": bool(settings["PROFILING"]),
+        "PROFILE_PSTATS_FILE": str(settings["PROFILE_PSTATS_FILE"]),
+        "PROFILE_SHOW_MAX": int(settings["PROFILE_SHOW_MAX"]),
+        "COMPILED_RULES": bool(settings["COMPILED_RULES"]),
+        "RULE_CACHE_DIR": str(settings["RULE_CACHE_DIR"]),
+        "RECURRENCE_PAST_DAYS": int(settings["RECURRENCE_PAST_DAYS"]),
+        "RECURRENCE_FUTURE_DAYS": int(settings["RECURRENCE_FUTURE_DAYS"]),
+        "METRICS_FILE": str(settings["METRICS_FILE"]),
+        "VECTORIZED": str(settings["VECTORIZED"]),
+        "VECTORIZE_MIN_EVENTS": int(settings["VECTORIZE_MIN_EVENTS"]),
+        "VECTORIZE_CONFLICTS_MIN_EVENTS": int(settings["VECTORIZE_CONFLICTS_MIN_EVENTS"]),
+        "ROOM_REPORT": bool(settings["ROOM_REPORT"]),
+        "ROOM_WEEK_HOURS": float(settings["ROOM_WEEK_HOURS"]),
+        "ROOM_FREE_QUERIES": list(settings["ROOM_FREE_QUERIES"]),
+    }
+
+
+CONFIG = bygg_config(USER_SETTINGS)
 
 MAZEMAP_URL_RE = re.compile(CONFIG["MAZEMAP_URL_REGEX"], re.IGNORECASE)
 LOCAL_TZ = tz.gettz(CONFIG["LOCAL_TIMEZONE"])
 
+# Settes av kjor() når COMPILED_RULES=True; None = naive regler rett fra CONFIG
+BUNT: Optional[RegelBunt] = None
+RULE_BUNDLE_FORMAT = 1
+
+# Settes av main() når PROFILING=True; None = ingen måling (ingen ekstra kostnad)
+PROFIL: Optional[RegelProfil] = None
+
+# Settes av main() når METRICS_FILE er satt; None = ingen metrikker
+METRIKK: Optional[KjoreMetrikker] = None
+METRICS_PREFIX = "split_tp_"
+METRICS_HELP = {
+    "last_run_timestamp_seconds": "Unix-tid da siste kjøring startet.",
+    "last_run_success": "1 hvis siste kjøring fullførte, ellers 0.",
+    "run_duration_seconds": "Total varighet for siste kjøring.",
+    "stage_duration_seconds": "Varighet per steg i siste kjøring.",
+    "fetch_duration_seconds": "Nedlastingstid per feed.",
+    "fetch_body_bytes": "Størrelse på feeden i bytes etter ev. gzip/deflate-dekoding.",
+    "events": "Antall events (VEVENT, en serie teller én gang) per utfall.",
+    "occurrences": "Antall enkeltforekomster i serier (RRULE) per utfall.",
+    "filter_rule_matches": "Antall treff per filterregel (Regel-ID).",
+    "filter_rule_removed": "Antall events/forekomster fjernet per filterregel (Regel-ID).",
+    "conflicts": "Antall konflikter på tvers av output-kalendere.",
+    "output_files": "Antall output-filer per status (skrevet/uendret).",
+}
+
+SNAPSHOT_FEED_FILE = "feed.ics"
+SNAPSHOT_EVENTS_FILE = "events.bin"
+SNAPSHOT_FORMAT = 3
+
+# Kilde-id for ICS_URL (EXTRA_ICS_FEEDS har egne id-er)
+HOVED_KILDE = "hoved"
+
+OUTPUT_ENGINES = ("stream", "ics")
+ICS_PRODID = "-//Split_TP_Calendar//NO"
+ICS_FOLD_OCTETS = 75
+ICS_HEADER = "BEGIN:VCALENDAR\r\nVERSION:2.0\r\n" f"PRODID:{ICS_PRODID}\r\n"
+ICS_FOOTER = "END:VCALENDAR\r\n"
+
+HORIZON_ID_RE = re.compile(r"[A-Za-z0-9_-]+")
+
+OUTPUT_COMPRESSORS = ("gz", "zst")
+MANIFEST_FORMAT = 1
+UTSKRIFT_BIT_BYTES = 1024 * 1024  # hashing/komprimering av output i biter
+
+# Settes bare av golden_kjoring(); None = ekte klokke
+FAST_NAA: Optional[datetime] = None
+GOLDEN_META_FILE = "golden.json"
+GOLDEN_FORMAT = 1
+# (motor, kompilerte regler) – alle kjøres mot samme golden-filer per motor
+GOLDEN_VARIANTER = (("stream", True), ("stream", False), ("ics", True), ("ics", False))
+
+# Strømmet nedlasting (download_ics_text_fail_fast)
+NEDLASTING_BIT_BYTES = 64 * 1024
+NEDLASTING_FREMDRIFT_BYTES = 5_000_000
+UTF8_BOM = b"\xef\xbb\xbf"
+ICAL_START = b"BEGIN:VCALENDAR"
+VEVENT_START = b"BEGIN:VEVENT"
+
+VECTORIZED_MODES = ("auto", "on", "off")
+ROM_TID_FORMAT = "%Y-%m-%d %H:%M"
+EPOKE_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MIKROSEKUND = timedelta(microseconds=1)
+
 
 # =============================================================================
 # Datamodeller
 # =============================================================================
+@dataclass
+class KildeEvent:
+    """
+    Ett event fra TP-feeden, med bare feltene scriptet faktisk bruker.
+    begin/end er tidssone-bevisste datetime i UTC.
+
+    Serier (RRULE) er fortsatt ett KildeEvent: begin/end er første forekomst,
+    exdates/rdates er UTC-datetimes, og tid_lokal=True betyr at serien gjentas
+    i lokal veggklokketid (DTSTART med TZID) i stedet for i UTC.
+    """
+    uid: str
+    name: str
+    location: str
+    description: str
+    begin: Any
+    end: Any
+    rrule: str = ""
+    exdates: Tuple[Any, ...] = ()
+    rdates: Tuple[Any, ...] = ()
+    tid_lokal: bool = False
+    kilde: str = HOVED_KILDE
+
+
 @dataclass
 class ChangeFlags:
     title_changed: bool
@@ -191,6 +498,9 @@ class ChangeFlags:
     used_default_type: bool
     room_parse_failed: bool
     filtered_out: bool
+    recurring: bool = False
+    duplicate: bool = False
+    occurrence: bool = False  # én forekomst av en serie, ikke en egen VEVENT
 
 
 @dataclass
@@ -221,6 +531,174 @@ class FilterRuleStats:
     reason: str
 
 
+@dataclass
+class UtEvent:
+    uid: str
+    name: str
+    begin: Any
+    end: Any
+    description: str
+    location: str
+    rrule: str = ""
+    exdates: Tuple[Any, ...] = ()
+    rdates: Tuple[Any, ...] = ()
+    tid_lokal: bool = False
+
+
+@dataclass
+class FilterKontekst:
+    fagkode: str
+    title: str
+    loc: str
+    begin_local: Any
+    end_local: Any
+
+
+@dataclass
+class RegelKostnad:
+    kategori: str
+    navn: str
+    evalueringer: int = 0
+    treff: int = 0
+    sekunder: float = 0.0
+
+
+class RegelProfil:
+    """Kumulativ tid og antall evalueringer per regel/klausul (kun når PROFILING=True)."""
+
+    def __init__(self) -> None:
+        self.kostnader: Dict[Tuple[str, str], RegelKostnad] = {}
+
+    def registrer(self, kategori: str, navn: str, sekunder: float, treff: int,
+                  evalueringer: int = 1) -> None:
+        # treff/evalueringer > 1 brukes av vektor_tidstreff (mange events per kall)
+        k = self.kostnader.get((kategori, navn))
+        if k is None:
+            k = self.kostnader[(kategori, navn)] = RegelKostnad(kategori, navn)
+        k.evalueringer += evalueringer
+        k.sekunder += sekunder
+        k.treff += int(treff)
+
+    def dyreste(self, kategori: str, antall: int) -> List[RegelKostnad]:
+        liste = [k for k in self.kostnader.values() if k.kategori == kategori]
+        liste.sort(key=lambda k: k.sekunder, reverse=True)
+        return liste[:antall]
+
+
+class KjoreMetrikker:
+    """
+    Måletall for én kjøring, skrevet som Prometheus-gauges (tekstformat 0.0.4).
+    Steg-tider måles som tid siden forrige steg() – kjor() kaller steg() etter hvert steg.
+    """
+
+    def __init__(self) -> None:
+        self.startet = time.time()
+        self._t0 = self._forrige = time.perf_counter()
+        self.verdier: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+
+    def sett(self, navn: str, verdi: float, **etiketter: str) -> None:
+        self.verdier.setdefault(navn, []).append((etiketter, float(verdi)))
+
+    def steg(self, navn: str) -> None:
+        naa = time.perf_counter()
+        self.sett("stage_duration_seconds", naa - self._forrige, stage=navn)
+        self._forrige = naa
+
+    def tekst(self, suksess: bool) -> str:
+        alle = dict(self.verdier)
+        alle["last_run_timestamp_seconds"] = [({}, self.startet)]
+        alle["last_run_success"] = [({}, 1.0 if suksess else 0.0)]
+        alle["run_duration_seconds"] = [({}, time.perf_counter() - self._t0)]
+
+        linjer: List[str] = []
+        for navn, hjelp in METRICS_HELP.items():
+            if navn not in alle:
+                continue
+            fullt = METRICS_PREFIX + navn
+            linjer.append(f"# HELP {fullt} {hjelp}")
+            linjer.append(f"# TYPE {fullt} gauge")
+            for etiketter, verdi in alle[navn]:
+                if etiketter:
+                    par = ",".join(
+                        f'{k}="{_prom_escape(v)}"' for k, v in etiketter.items())
+                    linjer.append(f"{fullt}{{{par}}} {_prom_tall(verdi)}")
+                else:
+                    linjer.append(f"{fullt} {_prom_tall(verdi)}")
+        return "\n".join(linjer) + "\n"
+
+    def lagre(self, sti: str, suksess: bool) -> None:
+        # Atomisk bytte: textfile collector skal aldri se en halvskrevet fil
+        mappe = os.path.dirname(sti)
+        if mappe:
+            os.makedirs(mappe, exist_ok=True)
+        with open(sti + ".tmp", "w", encoding="utf-8", newline="\n") as f:
+            f.write(self.tekst(suksess))
+        os.replace(sti + ".tmp", sti)
+
+
+def _prom_tall(verdi: float) -> str:
+    return str(int(verdi)) if verdi.is_integer() else repr(verdi)
+
+
+def _prom_escape(verdi: str) -> str:
+    return str(verdi).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@dataclass
+class KursMatcher:
+    """
+    Samme semantikk som den enkle løkka (første fagkode i COURSES-rekkefølge
+    som finnes i tittelen), men med én forhåndskompilert regex som raskt
+    avviser titler uten noen fagkode.
+    """
+    koder: Tuple[str, ...]
+    noen_kode: Any  # re.Pattern
+
+    def finn(self, tittel: str) -> Optional[str]:
+        if not tittel or self.noen_kode.search(tittel) is None:
+            return None
+        for kode in self.koder:
+            if kode in tittel:
+                return kode
+        return None
+
+
+@dataclass
+class RegelBunt:
+    """
+    Ferdig validerte og kompilerte regler, nøklet på hash av CONFIG.
+    type_regler: fagkode -> [(kompilert regex, typekode, mønster)]
+    filtre:      [(regel-id, regel, [(felt, ferdig tolket verdi)])]
+    """
+    config_sha256: str
+    kurs: KursMatcher
+    type_regler: Dict[str, List[Tuple[Any, str, str]]]
+    filtre: List[Tuple[str, Dict[str, Any], List[Tuple[str, Any]]]]
+
+
+class DuplikatIndeks:
+    """
+    Hash-indeks over beholdte events: (fagkode, start, slutt, rom, RRULE) ->
+    kilden som leverte eventet først. Én oppslag per event, altså O(n) totalt.
+    Bare kopier fra en annen feed regnes som duplikat; to ulike events med samme
+    fag/tid/rom i én feed (f.eks. forelesning + gruppetime) beholdes begge.
+    """
+
+    def __init__(self) -> None:
+        self.forste_kilde: Dict[Tuple[Any, ...], str] = {}
+        self.per_kilde: Dict[str, int] = {}
+
+    def er_duplikat(self, nokkel: Tuple[Any, ...], kilde: str) -> Optional[str]:
+        forste = self.forste_kilde.get(nokkel)
+        if forste is None:
+            self.forste_kilde[nokkel] = kilde
+            return None
+        if forste == kilde:
+            return None
+        self.per_kilde[kilde] = self.per_kilde.get(kilde, 0) + 1
+        return forste
+
+
 @dataclass
 class OutputEventForConflicts:
     short_code: str
@@ -228,6 +706,8 @@ class OutputEventForConflicts:
     end_local_dt: Any
     title: str
     location: str
+    bygg: str = ""
+    rom_funnet: bool = False
 
 
 # =============================================================================
@@ -246,22 +726,90 @@ def _parse_hhmm(s: str) -> Tuple[int, int]:
     return (hh_i, mm_i)
 
 
-def _match_optional_contains(hay: str, needle: Optional[str]) -> bool:
-    if not needle:
-        return True
-    return needle in hay
+def _match_hhmm(dt, hhmm: Any) -> bool:
+    hh, mm = _parse_hhmm(str(hhmm))
+    return dt.hour == hh and dt.minute == mm
+
+
+def _klausul_aktiv(felt: str, verdi: Any) -> bool:
+    # weekday=0 (mandag) er en gyldig verdi; alle andre felter er av når tomme
+    if felt == "weekday":
+        return verdi is not None
+    return bool(verdi)
+
+
+# EVENT_FILTERS-klausuler i evalueringsrekkefølge
+FILTER_FELT = (
+    "course_code",
+    "title_contains",
+    "title_regex",
+    "location_contains",
+    "location_regex",
+    "weekday",
+    "start_time",
+    "end_time",
+)
+
+# Naive tester: verdien brukes slik den står i CONFIG (tolkes for hvert event)
+FILTER_TESTER_NAIV = {
+    "course_code": lambda v, k: v == k.fagkode,
+    "title_contains": lambda v, k: v in k.title,
+    "title_regex": lambda v, k: re.search(v, k.title, flags=re.IGNORECASE) is not None,
+    "location_contains": lambda v, k: v in k.loc,
+    "location_regex": lambda v, k: re.search(v, k.loc, flags=re.IGNORECASE) is not None,
+    "weekday": lambda v, k: k.begin_local.weekday() == int(v),
+    "start_time": lambda v, k: _match_hhmm(k.begin_local, v),
+    "end_time": lambda v, k: _match_hhmm(k.end_local, v),
+}
 
+# Kompilerte tester: verdien er allerede tolket av _forbered_klausul()
+FILTER_TESTER_KOMPILERT = {
+    "course_code": lambda v, k: v == k.fagkode,
+    "title_contains": lambda v, k: v in k.title,
+    "title_regex": lambda v, k: v.search(k.title) is not None,
+    "location_contains": lambda v, k: v in k.loc,
+    "location_regex": lambda v, k: v.search(k.loc) is not None,
+    "weekday": lambda v, k: k.begin_local.weekday() == v,
+    "start_time": lambda v, k: k.begin_local.hour == v[0] and k.begin_local.minute == v[1],
+    "end_time": lambda v, k: k.end_local.hour == v[0] and k.end_local.minute == v[1],
+}
 
-def _match_optional_regex(text: str, pattern: Optional[str]) -> bool:
-    if not pattern:
-        return True
-    return re.search(pattern, text, flags=re.IGNORECASE) is not None
+
+# Klausuler som avhenger av tidspunktet (må sjekkes per forekomst i en serie)
+FILTER_TIDSFELT = ("weekday", "start_time", "end_time")
+
+
+def _forbered_klausul(felt: str, verdi: Any) -> Any:
+    if felt in ("title_regex", "location_regex"):
+        return re.compile(verdi, re.IGNORECASE)
+    if felt == "weekday":
+        return int(verdi)
+    if felt in ("start_time", "end_time"):
+        return _parse_hhmm(str(verdi))
+    return verdi
 
 
 def validate_config_fail_fast() -> None:
     if not CONFIG["ICS_URL"] or not isinstance(CONFIG["ICS_URL"], str):
         _die("FAIL_FAST: ICS_URL mangler eller er ikke tekst.")
 
+    if CONFIG["DOWNLOAD_MAX_MB"] <= 0:
+        _die("FAIL_FAST: DOWNLOAD_MAX_MB må være > 0.")
+
+    seen_feed_ids = {HOVED_KILDE}
+    for idx, feed in enumerate(CONFIG["EXTRA_ICS_FEEDS"], start=1):
+        if not isinstance(feed, dict):
+            _die(f"FAIL_FAST: EXTRA_ICS_FEEDS #{idx} må være dict med 'id' og 'url'.")
+        fid = feed.get("id")
+        if not isinstance(fid, str) or not HORIZON_ID_RE.fullmatch(fid):
+            _die(
+                f"FAIL_FAST: EXTRA_ICS_FEEDS #{idx} må ha 'id' (bokstaver, tall, - og _).")
+        if fid in seen_feed_ids:
+            _die(f"FAIL_FAST: EXTRA_ICS_FEEDS har duplikat id: '{fid}'.")
+        seen_feed_ids.add(fid)
+        if not isinstance(feed.get("url"), str) or not feed["url"]:
+            _die(f"FAIL_FAST: EXTRA_ICS_FEEDS '{fid}' mangler 'url'.")
+
     if not CONFIG["COURSES"] or not isinstance(CONFIG["COURSES"], dict):
         _die(
             "FAIL_FAST: COURSES er tom eller ugyldig. Legg inn fag i USER_SETTINGS['COURSES'].")
@@ -340,30 +888,606 @@ def validate_config_fail_fast() -> None:
                     _die(
                         f"FAIL_FAST: EVENT_FILTERS '{rid}': max_matches må være et heltall.")
 
+    if CONFIG["OUTPUT_ENGINE"] not in OUTPUT_ENGINES:
+        _die(
+            f"FAIL_FAST: OUTPUT_ENGINE må være en av {OUTPUT_ENGINES}, ikke '{CONFIG['OUTPUT_ENGINE']}'.")
+
+    # Valider HORIZON_WINDOWS
+    seen_window_ids = set()
+    for idx, vindu in enumerate(CONFIG["HORIZON_WINDOWS"], start=1):
+        if not isinstance(vindu, dict):
+            _die(f"FAIL_FAST: HORIZON_WINDOWS vindu #{idx} må være dict.")
+        wid = vindu.get("id")
+        if not isinstance(wid, str) or not HORIZON_ID_RE.fullmatch(wid):
+            _die(
+                f"FAIL_FAST: HORIZON_WINDOWS vindu #{idx} må ha 'id' (bokstaver, tall, - og _).")
+        if wid in seen_window_ids or wid == CONFIG["HORIZON_ARCHIVE_ID"]:
+            _die(f"FAIL_FAST: HORIZON_WINDOWS har duplikat id: '{wid}'.")
+        seen_window_ids.add(wid)
+        for felt, minimum in (("past_days", 0), ("future_days", 1)):
+            try:
+                dager = int(vindu.get(felt))
+            except Exception:
+                _die(
+                    f"FAIL_FAST: HORIZON_WINDOWS '{wid}': {felt} må være et heltall.")
+            if dager < minimum:
+                _die(
+                    f"FAIL_FAST: HORIZON_WINDOWS '{wid}': {felt} må være >= {minimum}.")
+
+    archive_id = CONFIG["HORIZON_ARCHIVE_ID"]
+    if archive_id:
+        if not HORIZON_ID_RE.fullmatch(archive_id):
+            _die(
+                "FAIL_FAST: HORIZON_ARCHIVE_ID kan bare inneholde bokstaver, tall, - og _.")
+        if not CONFIG["HORIZON_WINDOWS"]:
+            _die("FAIL_FAST: HORIZON_ARCHIVE_ID krever minst ett vindu i HORIZON_WINDOWS.")
+
+    if CONFIG["FREEBUSY_FILE"]:
+        if not CONFIG["FREEBUSY_FILE"].endswith(".ics"):
+            _die("FAIL_FAST: FREEBUSY_FILE må være et .ics filnavn (eller \"\" for av).")
+        if CONFIG["FREEBUSY_FILE"] in {m["file"] for m in CONFIG["COURSES"].values()}:
+            _die("FAIL_FAST: FREEBUSY_FILE kan ikke være samme fil som et fag i COURSES.")
+
+    for komp in CONFIG["OUTPUT_COMPRESS"]:
+        if komp not in OUTPUT_COMPRESSORS:
+            _die(
+                f"FAIL_FAST: OUTPUT_COMPRESS kan bare inneholde {OUTPUT_COMPRESSORS}, ikke '{komp}'.")
+
+    for felt in ("RECURRENCE_PAST_DAYS", "RECURRENCE_FUTURE_DAYS"):
+        if CONFIG[felt] < 0:
+            _die(f"FAIL_FAST: {felt} må være >= 0.")
+
+    if CONFIG["VECTORIZED"] not in VECTORIZED_MODES:
+        _die(f"FAIL_FAST: VECTORIZED må være en av {VECTORIZED_MODES}.")
+    for felt in ("VECTORIZE_MIN_EVENTS", "VECTORIZE_CONFLICTS_MIN_EVENTS"):
+        if CONFIG[felt] < 0:
+            _die(f"FAIL_FAST: {felt} må være >= 0.")
+
+    if CONFIG["ROOM_WEEK_HOURS"] <= 0:
+        _die("FAIL_FAST: ROOM_WEEK_HOURS må være > 0.")
+    for idx, sporring in enumerate(CONFIG["ROOM_FREE_QUERIES"], start=1):
+        if not isinstance(sporring, dict) or not isinstance(sporring.get("room"), str) \
+                or not sporring["room"].strip():
+            _die(f"FAIL_FAST: ROOM_FREE_QUERIES #{idx} må være dict med 'room' og 'at'.")
+        try:
+            datetime.strptime(str(sporring.get("at")), ROM_TID_FORMAT)
+        except ValueError:
+            _die(
+                f"FAIL_FAST: ROOM_FREE_QUERIES #{idx}: 'at' må være på formen "
+                f"'ÅÅÅÅ-MM-DD TT:MM', ikke '{sporring.get('at')}'.")
+
+    validate_miljo_fail_fast()
+
+
+def validate_miljo_fail_fast() -> None:
+    """
+    Sjekker som avhenger av maskinen (valgfrie pakker, tidssone-data), ikke av
+    configen. Billige, så de kjøres også når regel-bunten kommer fra cache.
+    """
+    if "zst" in CONFIG["OUTPUT_COMPRESS"] and zstandard is None:
+        _die(
+            "FAIL_FAST: OUTPUT_COMPRESS inneholder 'zst', men pakken mangler.\n"
+            "Installer med: pip install zstandard")
+
+    if CONFIG["VECTORIZED"] == "on" and np is None:
+        _die(
+            "FAIL_FAST: VECTORIZED='on', men numpy mangler.\n"
+            "Installer med: pip install numpy (eller bruk 'auto')")
+
     # Lokal tidssone må kunne resolves
     if LOCAL_TZ is None:
         _die(
             f"FAIL_FAST: Klarte ikke å tolke LOCAL_TIMEZONE='{CONFIG['LOCAL_TIMEZONE']}'.")
 
 
-def download_ics_text_fail_fast() -> str:
-    url = CONFIG["ICS_URL"]
-    print("Laster ned kalender fra TP …")
-    resp = requests.get(url, timeout=30)
+def ics_kilder() -> List[Tuple[str, str]]:
+    """[(kilde-id, url)] – ICS_URL først, deretter EXTRA_ICS_FEEDS i rekkefølge."""
+    return [(HOVED_KILDE, CONFIG["ICS_URL"])] + [
+        (str(f["id"]), str(f["url"])) for f in CONFIG["EXTRA_ICS_FEEDS"]]
 
-    if resp.status_code != 200:
-        _die(f"FAIL_FAST: ICS_URL returnerte status {resp.status_code}.")
 
-    text = resp.text or ""
-    if "BEGIN:VCALENDAR" not in text:
-        # Typisk feil: HTML/innlogging
-        snippet = text.strip().replace("\n", " ")[:200]
-        _die(
-            "FAIL_FAST: Nedlastet innhold ser ikke ut som iCalendar.\n"
-            "Mulig innlogging/HTML eller feil URL.\n"
-            f"Første tegn: {snippet}"
+def _ikke_ical_die(navn: str, start: bytes) -> None:
+    # Typisk feil: HTML/innlogging
+    snippet = start.decode("utf-8", errors="replace").strip().replace("\n", " ")[:200]
+    _die(
+        f"FAIL_FAST: Nedlastet innhold fra {navn} ser ikke ut som iCalendar.\n"
+        "Mulig innlogging/HTML eller feil URL.\n"
+        f"Første tegn: {snippet}"
+    )
+
+
+def download_ics_text_fail_fast(
+    url: Optional[str] = None, kilde: str = HOVED_KILDE,
+) -> Tuple[str, int]:
+    """
+    Strømmer svaret inn i én bytearray i stedet for å laste resp.text i sin
+    helhet: første bit må være iCalendar, størrelsen stoppes ved DOWNLOAD_MAX_MB,
+    og VEVENT-er telles underveis. Feil svar stopper før resten av body lastes ned.
+    Bodyen holdes én gang i minnet (ingen mellomkopi) før den dekodes.
+    Returnerer (tekst, antall bytes i body). requests har da allerede pakket ut
+    gzip/deflate, så tallet er størrelsen på feeden, ikke bytes over nettet.
+    """
+    url = url or CONFIG["ICS_URL"]
+    navn = "ICS_URL" if kilde == HOVED_KILDE else f"EXTRA_ICS_FEEDS '{kilde}'"
+    print("Laster ned kalender fra TP …" if kilde == HOVED_KILDE
+          else f"Laster ned kalender fra TP ({kilde}) …")
+    maks = int(CONFIG["DOWNLOAD_MAX_MB"] * 1_000_000)
+
+    with requests.get(url, timeout=30, stream=True) as resp:
+        if resp.status_code != 200:
+            _die(f"FAIL_FAST: {navn} returnerte status {resp.status_code}.")
+
+        lengde = str(resp.headers.get("Content-Length") or "")
+        if lengde.isdigit() and int(lengde) > maks:
+            _die(
+                f"FAIL_FAST: {navn} er {int(lengde) / 1e6:.1f} MB, over "
+                f"DOWNLOAD_MAX_MB={CONFIG['DOWNLOAD_MAX_MB']:g}.")
+
+        buf = bytearray()
+        start = b""
+        sjekket = False
+        lest = 0
+        antall = 0
+        hale = b""
+        neste_fremdrift = NEDLASTING_FREMDRIFT_BYTES
+        for bit in resp.iter_content(chunk_size=NEDLASTING_BIT_BYTES):
+            if not bit:
+                continue
+            lest += len(bit)
+            if lest > maks:
+                _die(
+                    f"FAIL_FAST: {navn} er større enn DOWNLOAD_MAX_MB="
+                    f"{CONFIG['DOWNLOAD_MAX_MB']:g} (avbrutt etter {lest / 1e6:.1f} MB).")
+
+            if not sjekket:
+                start += bit
+                hode = start[len(UTF8_BOM):] if start.startswith(UTF8_BOM) else start
+                hode = hode.lstrip()
+                if len(hode) >= len(ICAL_START):
+                    if hode[:len(ICAL_START)].upper() != ICAL_START:
+                        _ikke_ical_die(navn, start)
+                    sjekket = True
+
+            # Tell VEVENT-er også når "BEGIN:VEVENT" er delt mellom to biter
+            vindu = hale + bit
+            antall += vindu.count(VEVENT_START)
+            hale = vindu[-(len(VEVENT_START) - 1):]
+            buf += bit
+
+            if lest >= neste_fremdrift:
+                print(f"  … {lest / 1e6:.1f} MB lastet ned ({antall} VEVENT så langt)")
+                neste_fremdrift += NEDLASTING_FREMDRIFT_BYTES
+
+        if not sjekket:
+            _ikke_ical_die(navn, start)
+        tegnsett = resp.encoding or "utf-8"
+
+    print(f"Lastet ned {lest / 1e3:.0f} kB ({antall} VEVENT).")
+    return (buf.decode(tegnsett, errors="replace"), lest)
+
+
+# =============================================================================
+# Configfil (--config) + ferdigkompilert regel-bunt med cache
+# =============================================================================
+def last_config_fil(sti: str) -> Dict[str, Any]:
+    """
+    Leser TOML/JSON med de samme nøklene som USER_SETTINGS.
+    Nøkler som mangler i fila hentes fra USER_SETTINGS.
+    """
+    if not os.path.isfile(sti):
+        _die(f"FAIL_FAST: Fant ikke configfil '{sti}'.")
+    with open(sti, "rb") as f:
+        raw = f.read()
+
+    try:
+        if sti.lower().endswith(".toml"):
+            if tomllib is None:
+                _die("FAIL_FAST: TOML krever Python 3.11+ eller: pip install tomli")
+            data = tomllib.loads(raw.decode("utf-8"))
+        elif sti.lower().endswith(".json"):
+            data = json.loads(raw.decode("utf-8"))
+        else:
+            _die(f"FAIL_FAST: Configfil må ende med .toml eller .json: '{sti}'.")
+    except SystemExit:
+        raise
+    except Exception as e:
+        _die(f"FAIL_FAST: Klarte ikke å lese configfil '{sti}': {e}")
+
+    if not isinstance(data, dict):
+        _die(f"FAIL_FAST: Configfil '{sti}' må inneholde et objekt/tabell på toppnivå.")
+    ukjente = sorted(k for k in data if k not in USER_SETTINGS)
+    if ukjente:
+        _die(f"FAIL_FAST: Ukjente nøkler i configfil '{sti}': {', '.join(ukjente)}")
+
+    settings = dict(USER_SETTINGS)
+    settings.update(data)
+    return settings
+
+
+def aktiver_config(settings: Dict[str, Any]) -> None:
+    global MAZEMAP_URL_RE, LOCAL_TZ
+    try:
+        ny = bygg_config(settings)
+    except (TypeError, ValueError) as e:
+        _die(f"FAIL_FAST: Ugyldig verdi i config: {e}")
+    CONFIG.clear()
+    CONFIG.update(ny)
+    MAZEMAP_URL_RE = re.compile(CONFIG["MAZEMAP_URL_REGEX"], re.IGNORECASE)
+    LOCAL_TZ = tz.gettz(CONFIG["LOCAL_TIMEZONE"])
+
+
+def config_sha256() -> str:
+    kanonisk = json.dumps(
+        {"format": RULE_BUNDLE_FORMAT, "config": CONFIG},
+        sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(kanonisk.encode("utf-8")).hexdigest()
+
+
+def kompiler_regel_bunt(sha: str) -> RegelBunt:
+    koder = tuple(CONFIG["COURSES"].keys())
+    kurs = KursMatcher(
+        koder=koder,
+        noen_kode=re.compile("|".join(re.escape(k) for k in koder)),
+    )
+
+    type_regler: Dict[str, List[Tuple[Any, str, str]]] = {}
+    for fagkode, regler in CONFIG["TYPE_RULES"].items():
+        type_regler[fagkode] = [
+            (re.compile(r["pattern"], re.IGNORECASE), r["type"], r["pattern"])
+            for r in regler
+        ]
+
+    filtre = []
+    if CONFIG.get("ENABLE_EVENT_FILTERS", True):
+        for rid, regel, klausuler in _naive_filtre():
+            filtre.append((rid, regel, [(felt, _forbered_klausul(felt, verdi))
+                                        for felt, verdi in klausuler]))
+
+    return RegelBunt(config_sha256=sha, kurs=kurs,
+                     type_regler=type_regler, filtre=filtre)
+
+
+def last_eller_bygg_regel_bunt() -> RegelBunt:
+    """
+    Cache-treff: ingen config-validering eller kompilering (bare unpickle), men
+    miljøsjekkene (valgfrie pakker, tidssone) kjøres fortsatt.
+    Cache-bom: valider (FAIL_FAST), kompiler og lagre til neste gang.
+    """
+    sha = config_sha256()
+    mappe = CONFIG["RULE_CACHE_DIR"]
+    sti = os.path.join(mappe, f"rules-{sha[:16]}.bin")
+
+    if os.path.isfile(sti):
+        try:
+            with open(sti, "rb") as f:
+                bunt = pickle.load(f)
+            if isinstance(bunt, RegelBunt) and bunt.config_sha256 == sha:
+                if CONFIG["FAIL_FAST"]:
+                    validate_miljo_fail_fast()
+                return bunt
+        except Exception:
+            pass
+
+    if CONFIG["FAIL_FAST"]:
+        validate_config_fail_fast()
+    bunt = kompiler_regel_bunt(sha)
+
+    try:
+        os.makedirs(mappe, exist_ok=True)
+        with open(sti + ".tmp", "wb") as f:
+            pickle.dump(bunt, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(sti + ".tmp", sti)
+    except OSError as e:
+        print(f"Advarsel: klarte ikke å lagre regel-cache i '{mappe}': {e}")
+    return bunt
+
+
+# =============================================================================
+# Snapshot (rå feed + ferdig parsede events) for replay uten nett
+# =============================================================================
+def _til_utc(dt) -> datetime:
+    try:
+        d = dt.datetime  # arrow.Arrow
+    except Exception:
+        d = dt
+    if getattr(d, "tzinfo", None) is None:
+        d = d.replace(tzinfo=LOCAL_TZ)
+    return d.astimezone(timezone.utc)
+
+
+def _er_utc(dt) -> bool:
+    try:
+        d = dt.datetime  # arrow.Arrow
+    except Exception:
+        d = dt
+    return d.utcoffset() == timedelta(0) and d.tzname() in ("UTC", "Z")
+
+
+def _parse_ical_tider(linje: Any) -> List[datetime]:
+    """EXDATE/RDATE-verdier (kommaseparert, ev. TZID/VALUE=DATE/PERIOD) -> UTC."""
+    params = getattr(linje, "params", {}) or {}
+    tzid = (params.get("TZID") or [None])[0]
+    sone = (tz.gettz(tzid) if tzid else None) or LOCAL_TZ
+    tider: List[datetime] = []
+    for verdi in str(linje.value).split(","):
+        verdi = verdi.strip().split("/")[0]  # PERIOD: start/slutt -> start
+        if not verdi:
+            continue
+        if verdi.endswith("Z"):
+            d = datetime.strptime(verdi[:-1], "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc)
+        elif "T" in verdi:
+            d = datetime.strptime(verdi, "%Y%m%dT%H%M%S").replace(tzinfo=sone)
+        else:
+            d = datetime.strptime(verdi, "%Y%m%d").replace(tzinfo=sone)
+        tider.append(d.astimezone(timezone.utc))
+    return tider
+
+
+def kilde_events_fra_ics(ics_text: str, kilde: str = HOVED_KILDE) -> List[KildeEvent]:
+    kalender = Calendar(ics_text)
+    events: List[KildeEvent] = []
+    for e in kalender.events:
+        rrule = ""
+        exdates: List[datetime] = []
+        rdates: List[datetime] = []
+        # ics.py utvider ikke RRULE; linjene ligger urørt i e.extra
+        for linje in getattr(e, "extra", None) or []:
+            navn = getattr(linje, "name", "")
+            if navn == "RRULE":
+                rrule = str(linje.value)
+            elif navn == "EXDATE":
+                exdates.extend(_parse_ical_tider(linje))
+            elif navn == "RDATE":
+                rdates.extend(_parse_ical_tider(linje))
+        events.append(
+            KildeEvent(
+                uid=getattr(e, "uid", "") or "",
+                name=e.name or "",
+                location=e.location or "",
+                description=e.description or "",
+                begin=_til_utc(e.begin),
+                end=_til_utc(e.end),
+                rrule=rrule,
+                exdates=tuple(exdates),
+                rdates=tuple(rdates),
+                tid_lokal=bool(rrule) and not _er_utc(e.begin),
+                kilde=kilde,
+            )
+        )
+    return events
+
+
+def _snapshot_feed_fil(kilde: str) -> str:
+    if kilde == HOVED_KILDE:
+        return SNAPSHOT_FEED_FILE
+    return f"feed.{kilde}.ics"
+
+
+def _feeds_sha256(raws: List[Tuple[str, bytes]]) -> str:
+    h = hashlib.sha256()
+    for kilde, raw in raws:
+        h.update(kilde.encode("utf-8") + b"\0" + hashlib.sha256(raw).digest())
+    return h.hexdigest()
+
+
+def lagre_snapshot(feeds: List[Tuple[str, str]], events: List[KildeEvent]) -> None:
+    """
+    Skriver rå feed(er) + kompakt binærform av eventene (tupler med epoch-sekunder).
+    Binærfila er knyttet til feedene via sha256, så den aldri blir brukt mot feil feed.
+    """
+    mappe = CONFIG["SNAPSHOT_DIR"]
+    os.makedirs(mappe, exist_ok=True)
+
+    raws = [(kilde, ics_text.encode("utf-8")) for kilde, ics_text in feeds]
+    for kilde, raw in raws:
+        with open(os.path.join(mappe, _snapshot_feed_fil(kilde)), "wb") as f:
+            f.write(raw)
+
+    payload = {
+        "format": SNAPSHOT_FORMAT,
+        "feed_sha256": _feeds_sha256(raws),
+        "events": [
+            (e.uid, e.name, e.location, e.description,
+             int(e.begin.timestamp()), int(e.end.timestamp()),
+             e.rrule,
+             tuple(int(d.timestamp()) for d in e.exdates),
+             tuple(int(d.timestamp()) for d in e.rdates),
+             e.tid_lokal,
+             e.kilde)
+            for e in events
+        ],
+    }
+    with open(os.path.join(mappe, SNAPSHOT_EVENTS_FILE), "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def last_snapshot_fail_fast() -> List[KildeEvent]:
+    mappe = CONFIG["SNAPSHOT_DIR"]
+    events_path = os.path.join(mappe, SNAPSHOT_EVENTS_FILE)
+    print(f"REPLAY: leser snapshot fra '{mappe}' (ingen nedlasting) …")
+
+    raws: List[Tuple[str, bytes]] = []
+    for kilde, _ in ics_kilder():
+        feed_path = os.path.join(mappe, _snapshot_feed_fil(kilde))
+        if not os.path.isfile(feed_path):
+            _die(
+                f"FAIL_FAST: Fant ikke snapshot '{feed_path}'.\n"
+                "Kjør én gang med REPLAY_FROM_SNAPSHOT=False og SNAPSHOT_ENABLED=True først.")
+        with open(feed_path, "rb") as f:
+            raws.append((kilde, f.read()))
+
+    payload = None
+    if os.path.isfile(events_path):
+        try:
+            with open(events_path, "rb") as f:
+                payload = pickle.load(f)
+        except Exception:
+            payload = None
+
+    if (
+        not isinstance(payload, dict)
+        or payload.get("format") != SNAPSHOT_FORMAT
+        or payload.get("feed_sha256") != _feeds_sha256(raws)
+    ):
+        # Binærform mangler/er utdatert: parse rå feed(er) én gang og lagre på nytt
+        print("REPLAY: binær snapshot mangler eller er utdatert, parser rå feed én gang …")
+        feeds = [(kilde, raw.decode("utf-8")) for kilde, raw in raws]
+        events: List[KildeEvent] = []
+        for kilde, ics_text in feeds:
+            events.extend(kilde_events_fra_ics(ics_text, kilde))
+        lagre_snapshot(feeds, events)
+        return events
+
+    return [
+        KildeEvent(
+            uid=uid,
+            name=name,
+            location=location,
+            description=description,
+            begin=datetime.fromtimestamp(b, tz=timezone.utc),
+            end=datetime.fromtimestamp(e, tz=timezone.utc),
+            rrule=rrule,
+            exdates=tuple(datetime.fromtimestamp(d, tz=timezone.utc) for d in ex),
+            rdates=tuple(datetime.fromtimestamp(d, tz=timezone.utc) for d in rd),
+            tid_lokal=tid_lokal,
+            kilde=kilde,
         )
-    return text
+        for (uid, name, location, description, b, e, rrule, ex, rd, tid_lokal, kilde)
+        in payload["events"]
+    ]
+
+
+# =============================================================================
+# Gjentakende events (RRULE) – utvides lat, bare innenfor et vindu
+# =============================================================================
+def _utc_offset(epoke: int) -> int:
+    return int(datetime.fromtimestamp(epoke, LOCAL_TZ).utcoffset().total_seconds())
+
+
+def _offset_overganger(fra: int, til: int) -> Tuple[List[int], List[int]]:
+    """
+    Offset-skifter (sommertid) i LOCAL_TZ mellom to epoker: ([fra, skifte1, ...],
+    [offset fra og med hvert punkt]). 6-timers rutenett + binærsøk til sekundet.
+    """
+    overganger = [fra]
+    offsets = [_utc_offset(fra)]
+    t = fra
+    while t < til:
+        neste = min(t + 6 * 3600, til)
+        off = _utc_offset(neste)
+        if off != offsets[-1]:
+            lo, hi = t, neste
+            while hi - lo > 1:
+                midt = (lo + hi) // 2
+                if _utc_offset(midt) == offsets[-1]:
+                    lo = midt
+                else:
+                    hi = midt
+            overganger.append(hi)
+            offsets.append(off)
+        t = neste
+    return (overganger, offsets)
+
+
+def _ics_offset(sekunder: int) -> str:
+    fortegn = "-" if sekunder < 0 else "+"
+    t, rest = divmod(abs(sekunder), 3600)
+    m, sek = divmod(rest, 60)
+    return f"{fortegn}{t:02d}{m:02d}" + (f"{sek:02d}" if sek else "")
+
+
+def vtimezone_tekst(fra: datetime) -> str:
+    """
+    VTIMEZONE for LOCAL_TZ (RFC 5545 §3.6.5), påkrevd når vi skriver TZID=.
+    Skiftene finnes fra ett år før `fra`; følger et skifte samme årlige mønster
+    (f.eks. siste søndag i mars) hele veien, skrives det som én RRULE, ellers
+    som enkeltskifter.
+    """
+    start = int(fra.timestamp()) - 366 * 86400
+    overganger, offsets = _offset_overganger(start, start + 4 * 366 * 86400)
+    ukedager = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+    # (type, fra-offset, til-offset, navn) -> [(lokal starttid, BYMONTH, BYDAY)]
+    grupper: Dict[Tuple[str, int, int, str], List[Tuple[datetime, int, str]]] = {}
+    for i in range(1, len(overganger)):
+        t, forrige, off = overganger[i], offsets[i - 1], offsets[i]
+        etter = datetime.fromtimestamp(t, LOCAL_TZ)
+        lokal = datetime.fromtimestamp(t + forrige, timezone.utc).replace(tzinfo=None)
+        siste_uke = (lokal + timedelta(days=7)).month != lokal.month
+        nr = -1 if siste_uke else (lokal.day - 1) // 7 + 1
+        art = "DAYLIGHT" if etter.dst() else "STANDARD"
+        grupper.setdefault((art, forrige, off, etter.tzname() or ""), []).append(
+            (lokal, lokal.month, f"{nr}{ukedager[lokal.weekday()]}"))
+
+    linjer = ["BEGIN:VTIMEZONE", f"TZID:{CONFIG['LOCAL_TIMEZONE']}"]
+    if not grupper:
+        # Ingen sommertid: én STANDARD som gjelder for alltid
+        navn = datetime.fromtimestamp(start, LOCAL_TZ).tzname() or ""
+        grupper[("STANDARD", offsets[0], offsets[0], navn)] = [
+            (datetime(1970, 1, 1), 0, "")]
+    for (art, forrige, off, navn), skifter in grupper.items():
+        regler = {(mnd, dag, lokal.time()) for lokal, mnd, dag in skifter}
+        forste = skifter[0][0]
+        felles = [
+            f"TZOFFSETFROM:{_ics_offset(forrige)}",
+            f"TZOFFSETTO:{_ics_offset(off)}",
+        ] + ([f"TZNAME:{navn}"] if navn else [])
+        if len(regler) == 1 and skifter[0][1]:
+            mnd, dag, _ = regler.pop()
+            linjer += [f"BEGIN:{art}", "DTSTART:" + forste.strftime("%Y%m%dT%H%M%S"),
+                       f"RRULE:FREQ=YEARLY;BYMONTH={mnd};BYDAY={dag}"] + felles + [f"END:{art}"]
+        else:
+            for lokal, _, _ in skifter:
+                linjer += [f"BEGIN:{art}", "DTSTART:" + lokal.strftime("%Y%m%dT%H%M%S")] \
+                    + felles + [f"END:{art}"]
+    linjer.append("END:VTIMEZONE")
+    return "".join(_fold_linje(l) for l in linjer)
+
+
+def naa_utc() -> datetime:
+    # Golden-kjøringer låser "nå", så vindusavhengig output blir deterministisk
+    if FAST_NAA is not None:
+        return FAST_NAA
+    return datetime.now(timezone.utc)
+
+
+def gjentak_vindu() -> Tuple[datetime, datetime]:
+    naa = naa_utc()
+    return (naa - timedelta(days=CONFIG["RECURRENCE_PAST_DAYS"]),
+            naa + timedelta(days=CONFIG["RECURRENCE_FUTURE_DAYS"]))
+
+
+def _rruleset_for(ev: Any) -> Any:
+    # Samme tidssone som DTSTART, så ukentlige serier holder klokkeslettet over sommertid
+    sone = LOCAL_TZ if ev.tid_lokal else timezone.utc
+    dtstart = ev.begin.astimezone(sone)
+    rs = rruleset()
+    try:
+        rs.rrule(rrulestr(ev.rrule, dtstart=dtstart))
+    except (ValueError, TypeError) as e:
+        _die(f"FAIL_FAST: Klarte ikke å tolke RRULE '{ev.rrule}' (UID '{ev.uid}'): {e}")
+    for d in ev.rdates:
+        rs.rdate(d.astimezone(sone))
+    for d in ev.exdates:
+        rs.exdate(d.astimezone(sone))
+    return rs
+
+
+def forekomster(
+    ev: Any,
+    start: datetime,
+    slutt: Optional[datetime],
+) -> Iterator[Tuple[datetime, datetime]]:
+    """
+    (begin, end) i UTC for hver forekomst av serien som overlapper
+    [start, slutt), i tidsrekkefølge. slutt=None = ingen øvre grense.
+    Genereres lat: ingenting utenfor vinduet blir laget.
+    """
+    varighet = ev.end - ev.begin
+    for b in _rruleset_for(ev).xafter(start - varighet, inc=False):
+        if slutt is not None and b >= slutt:
+            return
+        yield (b.astimezone(timezone.utc), (b + varighet).astimezone(timezone.utc))
 
 
 # =============================================================================
@@ -436,6 +1560,8 @@ def parse_rom_og_bygg(lokasjon: str) -> Tuple[str, str, bool]:
 
 
 def finn_fagkode(orig_tittel: str) -> Optional[str]:
+    if BUNT is not None:
+        return BUNT.kurs.finn(orig_tittel)
     if not orig_tittel:
         return None
     for fagkode in CONFIG["COURSES"].keys():
@@ -444,98 +1570,228 @@ def finn_fagkode(orig_tittel: str) -> Optional[str]:
     return None
 
 
-def typekode_for_hendelse(fagkode: str, orig_tittel: str) -> Tuple[str, bool]:
-    regler = CONFIG["TYPE_RULES"].get(fagkode, [])
-    for regel in regler:
-        if re.search(regel["pattern"], orig_tittel, flags=re.IGNORECASE):
-            return (regel["type"], False)
-    return (CONFIG["DEFAULT_TYPE"], True)
-
+def _sok_naiv(monster: str, tekst: str) -> Any:
+    return re.search(monster, tekst, flags=re.IGNORECASE)
 
-def filtrer_bort_event(
-    event: Event,
-    fagkode: str,
-    filter_stats_by_id: Dict[str, FilterRuleStats],
-) -> Tuple[bool, Optional[str], Optional[str]]:
-    """
-    Returnerer (skal_filtreres, reason, rule_id).
-    Oppdaterer filter-statistikk (matched/removed).
-    """
-    if not CONFIG.get("ENABLE_EVENT_FILTERS", True):
-        return (False, None, None)
 
-    title = event.name or ""
-    loc = event.location or ""
+def _sok_kompilert(monster: Any, tekst: str) -> Any:
+    return monster.search(tekst)
 
-    begin_local = til_lokal_tid(event.begin)
-    end_local = til_lokal_tid(event.end)
 
+def _naive_filtre() -> List[Tuple[str, Dict[str, Any], List[Tuple[str, Any]]]]:
+    filtre = []
     for regel in CONFIG.get("EVENT_FILTERS", []):
         rid = regel.get("id") or "unknown-id"
+        klausuler = [(felt, regel.get(felt)) for felt in FILTER_FELT
+                     if _klausul_aktiv(felt, regel.get(felt))]
+        filtre.append((rid, regel, klausuler))
+    return filtre
 
-        # course_code
-        if regel.get("course_code") and regel["course_code"] != fagkode:
-            continue
 
-        # title
-        if not _match_optional_contains(title, regel.get("title_contains")):
-            continue
-        if not _match_optional_regex(title, regel.get("title_regex")):
-            continue
+def typekode_for_hendelse(fagkode: str, orig_tittel: str) -> Tuple[str, bool]:
+    if BUNT is not None:
+        regler = BUNT.type_regler.get(fagkode, [])
+        sok = _sok_kompilert
+    else:
+        regler = [(r["pattern"], r["type"], r["pattern"])
+                  for r in CONFIG["TYPE_RULES"].get(fagkode, [])]
+        sok = _sok_naiv
+    prof = PROFIL
+    for idx, (monster, typekode, kilde) in enumerate(regler):
+        if prof is None:
+            treff = sok(monster, orig_tittel)
+        else:
+            t0 = time.perf_counter()
+            treff = sok(monster, orig_tittel)
+            prof.registrer("TYPE_RULES", f"{fagkode}[{idx}] /{kilde}/",
+                           time.perf_counter() - t0, treff is not None)
+        if treff:
+            return (typekode, False)
+    return (CONFIG["DEFAULT_TYPE"], True)
 
-        # location
-        if not _match_optional_contains(loc, regel.get("location_contains")):
-            continue
-        if not _match_optional_regex(loc, regel.get("location_regex")):
-            continue
 
-        # weekday
-        weekday = regel.get("weekday")
-        if weekday is not None and begin_local.weekday() != int(weekday):
-            continue
+def _aktive_filtre() -> Tuple[List[Tuple[str, Dict[str, Any], List[Tuple[str, Any]]]], Dict[str, Any]]:
+    if BUNT is not None:
+        return (BUNT.filtre, FILTER_TESTER_KOMPILERT)
+    return (_naive_filtre(), FILTER_TESTER_NAIV)
 
-        # start_time
-        start_time = regel.get("start_time")
-        if start_time:
-            hh, mm = _parse_hhmm(str(start_time))
-            if not (begin_local.hour == hh and begin_local.minute == mm):
-                continue
 
-        # end_time
-        end_time = regel.get("end_time")
-        if end_time:
-            hh, mm = _parse_hhmm(str(end_time))
-            if not (end_local.hour == hh and end_local.minute == mm):
-                continue
+def _klausuler_treffer(
+    rid: str,
+    klausuler: List[Tuple[str, Any]],
+    kontekst: FilterKontekst,
+    tester: Dict[str, Any],
+) -> bool:
+    prof = PROFIL
+    for felt, verdi in klausuler:
+        test = tester[felt]
+        if prof is None:
+            ok = test(verdi, kontekst)
+        else:
+            t0 = time.perf_counter()
+            ok = test(verdi, kontekst)
+            prof.registrer("klausul", f"{rid}.{felt}",
+                           time.perf_counter() - t0, ok)
+        if not ok:
+            return False
+    return True
+
+
+def _registrer_filtertreff(
+    rid: str,
+    regel: Dict[str, Any],
+    filter_stats_by_id: Dict[str, FilterRuleStats],
+    title: str,
+    loc: str,
+    begin: Any,
+    end: Any,
+) -> str:
+    st = filter_stats_by_id[rid]
+    st.matched += 1
+
+    max_matches = st.max_matches
+    if max_matches is not None and st.matched > max_matches:
+        _die(
+            f"FAIL_FAST: Filterregel '{rid}' matchet mer enn max_matches={max_matches}.\n"
+            f"Siste treff: '{title}' | LOCATION='{loc}' | {fmt_local(begin)}–{fmt_local(end)}"
+        )
 
-        # MATCH!
-        st = filter_stats_by_id[rid]
-        st.matched += 1
+    reason = regel.get(
+        "reason") or st.reason or "Filtrert: match på EVENT_FILTERS"
+    st.removed += 1
+    return reason
 
-        max_matches = st.max_matches
-        if max_matches is not None and st.matched > max_matches:
-            _die(
-                f"FAIL_FAST: Filterregel '{rid}' matchet mer enn max_matches={max_matches}.\n"
-                f"Siste treff: '{title}' | LOCATION='{loc}' | {fmt_local(event.begin)}–{fmt_local(event.end)}"
-            )
 
-        reason = regel.get(
-            "reason") or st.reason or "Filtrert: match på EVENT_FILTERS"
-        st.removed += 1
+def filtrer_bort_event(
+    event: KildeEvent,
+    fagkode: str,
+    filter_stats_by_id: Dict[str, FilterRuleStats],
+    tids_treff: Optional[FrozenSet[str]] = None,
+) -> Tuple[bool, Optional[str], Optional[str]]:
+    """
+    Returnerer (skal_filtreres, reason, rule_id).
+    Oppdaterer filter-statistikk (matched/removed).
+    tids_treff (fra vektor_tidstreff): Regel-ID-ene der weekday/start_time/
+    end_time allerede er sjekket og holder; da sjekkes bare de andre klausulene.
+    """
+    if not CONFIG.get("ENABLE_EVENT_FILTERS", True):
+        return (False, None, None)
+
+    title = event.name
+    loc = event.location
+
+    if tids_treff is None:
+        kontekst = FilterKontekst(
+            fagkode=fagkode,
+            title=title,
+            loc=loc,
+            begin_local=til_lokal_tid(event.begin),
+            end_local=til_lokal_tid(event.end),
+        )
+    else:
+        kontekst = FilterKontekst(
+            fagkode=fagkode, title=title, loc=loc, begin_local=None, end_local=None)
+    prof = PROFIL
+    filtre, tester = _aktive_filtre()
+
+    for rid, regel, klausuler in filtre:
+        t_regel = time.perf_counter() if prof is not None else 0.0
+        if tids_treff is None:
+            treff = _klausuler_treffer(rid, klausuler, kontekst, tester)
+        else:
+            statiske = [(f, v) for f, v in klausuler if f not in FILTER_TIDSFELT]
+            treff = (
+                (len(statiske) == len(klausuler) or rid in tids_treff)
+                and _klausuler_treffer(rid, statiske, kontekst, tester))
+        if prof is not None:
+            prof.registrer("EVENT_FILTERS", rid,
+                           time.perf_counter() - t_regel, treff)
+        if not treff:
+            continue
+
+        # MATCH!
+        reason = _registrer_filtertreff(
+            rid, regel, filter_stats_by_id, title, loc, event.begin, event.end)
         return (True, reason, rid)
 
     return (False, None, None)
 
 
+def filtrer_bort_forekomster(
+    event: KildeEvent,
+    fagkode: str,
+    filter_stats_by_id: Dict[str, FilterRuleStats],
+) -> Tuple[Optional[Tuple[str, str]], List[Tuple[datetime, datetime, str, str]]]:
+    """
+    Filter for en serie (RRULE). Klausuler som ikke avhenger av tid evalueres én
+    gang for hele serien. En regel uten weekday/start_time/end_time fjerner hele
+    serien (ett treff, som for en enkelt VEVENT); ellers evalueres tidsklausulene
+    per forekomst, og serien utvides bare hvis minst én regel fortsatt kan treffe.
+    Returnerer ((reason, rule_id) hvis hele serien fjernes, ellers None,
+    [(begin, end, reason, rule_id)] for forekomster som fjernes).
+    """
+    if not CONFIG.get("ENABLE_EVENT_FILTERS", True):
+        return (None, [])
+
+    title = event.name
+    loc = event.location
+    serie_kontekst = FilterKontekst(
+        fagkode=fagkode, title=title, loc=loc, begin_local=None, end_local=None)
+    prof = PROFIL
+    filtre, tester = _aktive_filtre()
+
+    kandidater = []
+    for rid, regel, klausuler in filtre:
+        t_regel = time.perf_counter() if prof is not None else 0.0
+        statiske = [(f, v) for f, v in klausuler if f not in FILTER_TIDSFELT]
+        tid = [(f, v) for f, v in klausuler if f in FILTER_TIDSFELT]
+        treff = _klausuler_treffer(rid, statiske, serie_kontekst, tester)
+        if prof is not None:
+            # Treff telles først når også tidsklausulene holder (per forekomst)
+            prof.registrer("EVENT_FILTERS", rid,
+                           time.perf_counter() - t_regel, treff and not tid)
+        if treff:
+            kandidater.append((rid, regel, tid))
+    if not kandidater:
+        return (None, [])
+
+    for rid, regel, tid in kandidater:
+        if not tid:
+            reason = _registrer_filtertreff(
+                rid, regel, filter_stats_by_id, title, loc, event.begin, event.end)
+            return ((reason, rid), [])
+
+    bort: List[Tuple[datetime, datetime, str, str]] = []
+    start, slutt = gjentak_vindu()
+    for b, e in forekomster(event, start, slutt):
+        kontekst = FilterKontekst(
+            fagkode=fagkode, title=title, loc=loc,
+            begin_local=til_lokal_tid(b), end_local=til_lokal_tid(e))
+        for rid, regel, tid in kandidater:
+            t_regel = time.perf_counter() if prof is not None else 0.0
+            treff = _klausuler_treffer(rid, tid, kontekst, tester)
+            if prof is not None:
+                prof.registrer("EVENT_FILTERS", rid,
+                               time.perf_counter() - t_regel, treff)
+            if treff:
+                reason = _registrer_filtertreff(
+                    rid, regel, filter_stats_by_id, title, loc, b, e)
+                bort.append((b, e, reason, rid))
+                break
+    return (None, bort)
+
+
 def transformer_hendelse(
-    event: Event,
+    event: KildeEvent,
     report: List[ReportItem],
     filter_stats_by_id: Dict[str, FilterRuleStats],
-) -> Optional[Tuple[str, Event, OutputEventForConflicts]]:
-    old_title = event.name or ""
-    old_location = event.location or ""
-    old_desc = event.description or ""
-    uid = getattr(event, "uid", "") or ""
+    duplikater: Optional[DuplikatIndeks] = None,
+    tids_treff: Optional[FrozenSet[str]] = None,
+) -> Optional[Tuple[str, UtEvent, OutputEventForConflicts]]:
+    old_title = event.name
+    old_location = event.location
+    old_desc = event.description
+    uid = event.uid
 
     begin_local_str = fmt_local(event.begin)
     end_local_str = fmt_local(event.end)
@@ -571,9 +1827,86 @@ def transformer_hendelse(
         )
         return None
 
-    # Filter
-    skal_filtreres, grunn, rid = filtrer_bort_event(
-        event, fagkode, filter_stats_by_id)
+    rom, bygg, ok = parse_rom_og_bygg(old_location)
+
+    # Samme forelesning fra flere feeder: behold første, før filtrene teller den
+    if duplikater is not None:
+        nokkel = (fagkode, int(event.begin.timestamp()), int(event.end.timestamp()),
+                  rom if ok else (old_location or "").strip(), event.rrule)
+        forste = duplikater.er_duplikat(nokkel, event.kilde)
+        if forste is not None:
+            flags = ChangeFlags(
+                title_changed=False,
+                location_changed=False,
+                description_changed=False,
+                mazemap_removed=False,
+                used_default_type=False,
+                room_parse_failed=False,
+                filtered_out=False,
+                recurring=bool(event.rrule),
+                duplicate=True,
+            )
+            report.append(
+                ReportItem(
+                    uid=uid,
+                    course_code=fagkode,
+                    short_code=CONFIG["COURSES"][fagkode]["short"],
+                    begin_raw=str(event.begin),
+                    end_raw=str(event.end),
+                    begin_local=begin_local_str,
+                    end_local=end_local_str,
+                    old_title=old_title,
+                    new_title=None,
+                    old_location=old_location,
+                    new_location=None,
+                    flags=flags,
+                    filter_reason=f"Duplikat fra '{event.kilde}' (først sett i '{forste}')",
+                    filter_id=None,
+                )
+            )
+            return None
+
+    # Filter (serier: per forekomst i vinduet, resten av serien beholdes)
+    bort: List[Tuple[datetime, datetime, str, str]] = []
+    if event.rrule:
+        hel_serie, bort = filtrer_bort_forekomster(event, fagkode, filter_stats_by_id)
+        skal_filtreres, grunn, rid = (
+            (True, hel_serie[0], hel_serie[1]) if hel_serie else (False, None, None))
+    else:
+        skal_filtreres, grunn, rid = filtrer_bort_event(
+            event, fagkode, filter_stats_by_id, tids_treff)
+
+    for b, e, b_grunn, b_rid in bort:
+        flags = ChangeFlags(
+            title_changed=False,
+            location_changed=False,
+            description_changed=False,
+            mazemap_removed=False,
+            used_default_type=False,
+            room_parse_failed=False,
+            filtered_out=True,
+            recurring=True,
+            occurrence=True,
+        )
+        report.append(
+            ReportItem(
+                uid=uid,
+                course_code=fagkode,
+                short_code=CONFIG["COURSES"][fagkode]["short"],
+                begin_raw=str(b),
+                end_raw=str(e),
+                begin_local=fmt_local(b),
+                end_local=fmt_local(e),
+                old_title=old_title,
+                new_title=None,
+                old_location=old_location,
+                new_location=None,
+                flags=flags,
+                filter_reason=b_grunn,
+                filter_id=b_rid,
+            )
+        )
+
     if skal_filtreres:
         kortkode = CONFIG["COURSES"][fagkode]["short"]
         flags = ChangeFlags(
@@ -608,7 +1941,6 @@ def transformer_hendelse(
     kortkode = CONFIG["COURSES"][fagkode]["short"]
     typekode, used_default = typekode_for_hendelse(fagkode, old_title)
 
-    rom, bygg, ok = parse_rom_og_bygg(old_location)
     cleaned_desc, mazemap_removed = fjern_mazemap_lenker(old_desc)
 
     linjer = []
@@ -634,6 +1966,7 @@ def transformer_hendelse(
         used_default_type=used_default,
         room_parse_failed=not ok,
         filtered_out=False,
+        recurring=bool(event.rrule),
     )
 
     report.append(
@@ -655,13 +1988,18 @@ def transformer_hendelse(
         )
     )
 
-    ny = Event()
-    ny.name = new_title
-    ny.begin = event.begin
-    ny.end = event.end
-    ny.description = new_desc
-    ny.location = new_location
-    ny.uid = uid
+    ny = UtEvent(
+        uid=uid,
+        name=new_title,
+        begin=event.begin,
+        end=event.end,
+        description=new_desc,
+        location=new_location,
+        rrule=event.rrule,
+        exdates=event.exdates + tuple(b for b, _, _, _ in bort),
+        rdates=event.rdates,
+        tid_lokal=event.tid_lokal,
+    )
 
     c = OutputEventForConflicts(
         short_code=kortkode,
@@ -669,57 +2007,849 @@ def transformer_hendelse(
         end_local_dt=til_lokal_tid(event.end),
         title=new_title,
         location=new_location,
+        bygg=bygg,
+        rom_funnet=ok,
     )
 
     return (kortkode, ny, c)
 
 
+# =============================================================================
+# Publisering: komprimerte søsken + manifest med innholds-hash
+# =============================================================================
+def _fil_sha256(sti: str) -> Tuple[str, int]:
+    """(sha256-hex, antall bytes) for en fil, lest i biter."""
+    h = hashlib.sha256()
+    storrelse = 0
+    with open(sti, "rb") as f:
+        for bit in iter(lambda: f.read(UTSKRIFT_BIT_BYTES), b""):
+            h.update(bit)
+            storrelse += len(bit)
+    return (h.hexdigest(), storrelse)
+
+
+class OutputPublisering:
+    """
+    Bytter inn ferdige '.tmp'-filer. Med manifest slått på sammenlignes sha256
+    mot forrige kjøring: uendrede filer (og søsken) røres ikke i det hele tatt.
+    Kalenderen regenereres fortsatt hver gang; det er bare publiseringen som
+    hoppes over. Filene leses i biter, aldri i sin helhet inn i minnet.
+    """
+
+    def __init__(self, manifest_fil: str, kompresjon: List[str]):
+        self.manifest_fil = manifest_fil
+        self.kompresjon = list(kompresjon)
+        self.filer: Dict[str, Dict[str, Any]] = {}
+        self.status: Dict[str, str] = {}
+
+        if manifest_fil and os.path.isfile(manifest_fil):
+            try:
+                with open(manifest_fil, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("format") == MANIFEST_FORMAT:
+                    self.filer = dict(data.get("files", {}))
+            except Exception:
+                self.filer = {}
+
+    def _uendret(self, filnavn: str, sha: str) -> bool:
+        if not self.manifest_fil:
+            return False
+        forrige = self.filer.get(filnavn)
+        if not forrige or forrige.get("sha256") != sha or not os.path.isfile(filnavn):
+            return False
+        for komp in self.kompresjon:
+            sosken = forrige.get(komp)
+            if not sosken or not os.path.isfile(sosken["file"]):
+                return False
+        return True
+
+    def publiser(self, tmp: str, filnavn: str) -> None:
+        if not self.manifest_fil and not self.kompresjon:
+            os.replace(tmp, filnavn)
+            self.status[filnavn] = "skrevet"
+            return
+
+        sha, storrelse = _fil_sha256(tmp)
+        if self._uendret(filnavn, sha):
+            os.remove(tmp)
+            self.status[filnavn] = "uendret"
+            return
+
+        os.replace(tmp, filnavn)
+        oppforing: Dict[str, Any] = {"sha256": sha, "bytes": storrelse}
+        for komp in self.kompresjon:
+            sosken = f"{filnavn}.{komp}"
+            with open(filnavn, "rb") as kilde, open(sosken + ".tmp", "wb") as f:
+                if komp == "gz":
+                    # mtime=0 og tomt filnavn => samme innhold gir samme bytes (og hash)
+                    with gzip.GzipFile(filename="", mode="wb", compresslevel=9,
+                                       fileobj=f, mtime=0) as z:
+                        shutil.copyfileobj(kilde, z, UTSKRIFT_BIT_BYTES)
+                else:
+                    with zstandard.ZstdCompressor(level=19).stream_writer(
+                            f, size=storrelse, closefd=False) as z:
+                        shutil.copyfileobj(kilde, z, UTSKRIFT_BIT_BYTES)
+            os.replace(sosken + ".tmp", sosken)
+            k_sha, k_storrelse = _fil_sha256(sosken)
+            oppforing[komp] = {"file": sosken, "sha256": k_sha, "bytes": k_storrelse}
+        self.filer[filnavn] = oppforing
+        self.status[filnavn] = "skrevet"
+
+    def lagre_manifest(self) -> None:
+        if not self.manifest_fil:
+            return
+        tmp = self.manifest_fil + ".tmp"
+        with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+            json.dump({"format": MANIFEST_FORMAT, "files": self.filer},
+                      f, indent=2, sort_keys=True, ensure_ascii=False)
+            f.write("\n")
+        os.replace(tmp, self.manifest_fil)
+
+
+# =============================================================================
+# Output-kalendere (strømmende skriver + ics.Calendar-variant)
+# =============================================================================
+def _ics_escape(tekst: str) -> str:
+    # Samme escaping som ics.py bruker
+    return (
+        tekst.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _ics_utc(dt) -> str:
+    return _til_utc(dt).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _fold_linje(linje: str) -> str:
+    """
+    Bretter en innholdslinje på 75 oktetter (RFC 5545 §3.1) uten å dele
+    UTF-8-tegn. Returnerer linjen med CRLF.
+    """
+    raw = linje.encode("utf-8")
+    if len(raw) <= ICS_FOLD_OCTETS:
+        return linje + "\r\n"
+
+    deler: List[str] = []
+    start = 0
+    grense = ICS_FOLD_OCTETS
+    while start < len(raw):
+        slutt = min(start + grense, len(raw))
+        while slutt < len(raw) and (raw[slutt] & 0xC0) == 0x80:
+            slutt -= 1
+        deler.append(raw[start:slutt].decode("utf-8"))
+        start = slutt
+        grense = ICS_FOLD_OCTETS - 1  # fortsettelseslinjer starter med mellomrom
+    return "\r\n ".join(deler) + "\r\n"
+
+
+def vevent_tekst(ut: UtEvent) -> str:
+    # Samme feltrekkefølge som ics.py, så diffene mot gamle filer blir små
+    uid = ut.uid or hashlib.sha1(
+        f"{ut.name}|{_ics_utc(ut.begin)}".encode("utf-8")).hexdigest()
+    if ut.tid_lokal:
+        # Serie i lokal veggklokketid: behold TZID så klokkeslettet følger sommertid
+        tzp = f";TZID={CONFIG['LOCAL_TIMEZONE']}"
+        def tid(d): return til_lokal_tid(d).strftime("%Y%m%dT%H%M%S")
+    else:
+        tzp = ""
+        tid = _ics_utc
+
+    linjer = ["BEGIN:VEVENT"]
+    if ut.description:
+        linjer.append("DESCRIPTION:" + _ics_escape(ut.description))
+    linjer.append(f"DTEND{tzp}:" + tid(ut.end))
+    if ut.location:
+        linjer.append("LOCATION:" + _ics_escape(ut.location))
+    linjer.append(f"DTSTART{tzp}:" + tid(ut.begin))
+    if ut.rrule:
+        linjer.append("RRULE:" + ut.rrule)
+        if ut.exdates:
+            linjer.append(f"EXDATE{tzp}:" + ",".join(tid(d) for d in sorted(ut.exdates)))
+        if ut.rdates:
+            linjer.append(f"RDATE{tzp}:" + ",".join(tid(d) for d in sorted(ut.rdates)))
+    if ut.name:
+        linjer.append("SUMMARY:" + _ics_escape(ut.name))
+    linjer.append("UID:" + uid)
+    linjer.append("END:VEVENT")
+    return "".join(_fold_linje(l) for l in linjer)
+
+
+class StreamKalenderSkriver:
+    """
+    Skriver VEVENT-tekst rett til bufrede filer etter hvert som events kommer.
+    Skriver til '<fil>.tmp' og bytter inn først i fullfor(), så en FAIL_FAST
+    midt i kjøringen aldri etterlater halve kalendere.
+    """
+
+    def __init__(
+        self,
+        courses: Dict[str, Dict[str, str]],
+        dry_run: bool,
+        publisering: OutputPublisering,
+        vtimezone_for: Optional[Dict[str, str]] = None,
+    ):
+        self.dry_run = dry_run
+        self.publisering = publisering
+        self.antall: Dict[str, int] = {}
+        self.filer: Dict[str, List[Any]] = {}
+        self.tmp_til_fil: List[Tuple[str, str]] = []
+
+        for _, meta in courses.items():
+            kort = meta["short"]
+            self.antall[kort] = 0
+            self.filer.setdefault(kort, [])
+            if dry_run:
+                continue
+            tmp = meta["file"] + ".tmp"
+            f = open(tmp, "w", encoding="utf-8", newline="", buffering=1 << 16)
+            f.write(ICS_HEADER)
+            f.write((vtimezone_for or {}).get(kort, ""))
+            self.filer[kort].append(f)
+            self.tmp_til_fil.append((tmp, meta["file"]))
+
+    def skriv(self, kort: str, ut: UtEvent) -> None:
+        self.antall[kort] += 1
+        if self.dry_run:
+            return
+        tekst = vevent_tekst(ut)
+        for f in self.filer[kort]:
+            f.write(tekst)
+
+    def antall_per_kalender(self) -> Dict[str, int]:
+        return dict(self.antall)
+
+    def fullfor(self) -> None:
+        for filer in self.filer.values():
+            for f in filer:
+                f.write(ICS_FOOTER)
+                f.close()
+        for tmp, fil in self.tmp_til_fil:
+            self.publisering.publiser(tmp, fil)
+
+    def avbryt(self) -> None:
+        for filer in self.filer.values():
+            for f in filer:
+                f.close()
+        for tmp, _ in self.tmp_til_fil:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+class IcsKalenderSkriver:
+    """
+    Opprinnelig variant: bygger ics.Event i én ics.Calendar per kortkode og
+    serialiserer alt til slutt.
+    """
+
+    def __init__(
+        self,
+        courses: Dict[str, Dict[str, str]],
+        dry_run: bool,
+        publisering: OutputPublisering,
+    ):
+        self.dry_run = dry_run
+        self.publisering = publisering
+        self.courses = courses
+        self.kalendere: Dict[str, Calendar] = {}
+        for _, meta in courses.items():
+            self.kalendere[meta["short"]] = Calendar()
+
+    def skriv(self, kort: str, ut: UtEvent) -> None:
+        ny = Event()
+        ny.name = ut.name
+        ny.begin = ut.begin
+        ny.end = ut.end
+        ny.description = ut.description
+        ny.location = ut.location
+        ny.uid = ut.uid
+        if ut.rrule:
+            if ut.tid_lokal:
+                _die(
+                    "FAIL_FAST: OUTPUT_ENGINE='ics' kan ikke skrive serier (RRULE) i lokal tid.\n"
+                    f"Bruk OUTPUT_ENGINE='stream' (UID '{ut.uid}').")
+            ny.extra.append(ContentLine("RRULE", value=ut.rrule))
+            if ut.exdates:
+                ny.extra.append(ContentLine(
+                    "EXDATE", value=",".join(_ics_utc(d) for d in sorted(ut.exdates))))
+            if ut.rdates:
+                ny.extra.append(ContentLine(
+                    "RDATE", value=",".join(_ics_utc(d) for d in sorted(ut.rdates))))
+        self.kalendere[kort].events.add(ny)
+
+    def antall_per_kalender(self) -> Dict[str, int]:
+        return {k: len(cal.events) for k, cal in self.kalendere.items()}
+
+    def fullfor(self) -> None:
+        if self.dry_run:
+            return
+        for _, meta in self.courses.items():
+            tmp = meta["file"] + ".tmp"
+            with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+                f.write(self.kalendere[meta["short"]].serialize())
+            self.publisering.publiser(tmp, meta["file"])
+
+    def avbryt(self) -> None:
+        pass
+
+
+def skriv_kalenderfil(
+    filnavn: str,
+    events: List[UtEvent],
+    publisering: OutputPublisering,
+) -> None:
+    tmp = filnavn + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8", newline="", buffering=1 << 16) as f:
+            f.write(ICS_HEADER)
+            lokale = [ut.begin for ut in events if ut.tid_lokal]
+            if lokale:
+                f.write(vtimezone_tekst(min(lokale)))
+            for ut in events:
+                f.write(vevent_tekst(ut))
+            f.write(ICS_FOOTER)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    publisering.publiser(tmp, filnavn)
+
+
+def lag_kalender_skriver(
+    dry_run: bool,
+    publisering: OutputPublisering,
+    vtimezone_for: Optional[Dict[str, str]] = None,
+) -> Any:
+    if CONFIG["OUTPUT_ENGINE"] == "ics":
+        return IcsKalenderSkriver(CONFIG["COURSES"], dry_run, publisering)
+    return StreamKalenderSkriver(CONFIG["COURSES"], dry_run, publisering, vtimezone_for)
+
+
+# =============================================================================
+# Horisont-vinduer (sortert indeks per kortkode)
+# =============================================================================
+class HorisontIndeks:
+    """
+    Events per kortkode sortert på start (epoch-sekunder). Et vindu slås opp med
+    bisect: alt som kan overlappe [start, slutt) ligger mellom
+    start - lengste_varighet og slutt, så vi ser aldri på resten av semesteret.
+    """
+
+    def __init__(self) -> None:
+        self.events: Dict[str, List[Tuple[int, int, UtEvent]]] = {}
+        self.starter: Dict[str, List[int]] = {}
+        self.maks_varighet: Dict[str, int] = {}
+        # Serier (RRULE) utvides ikke; vi sjekker bare om de har en forekomst i vinduet
+        self.serier: Dict[str, List[UtEvent]] = {}
+
+    def legg_til(self, kort: str, ut: UtEvent) -> None:
+        if ut.rrule:
+            self.serier.setdefault(kort, []).append(ut)
+            return
+        b = int(_til_utc(ut.begin).timestamp())
+        e = int(_til_utc(ut.end).timestamp())
+        self.events.setdefault(kort, []).append((b, e, ut))
+        self.maks_varighet[kort] = max(self.maks_varighet.get(kort, 0), e - b)
+
+    def bygg(self) -> None:
+        for kort, liste in self.events.items():
+            liste.sort(key=lambda t: (t[0], t[1]))
+            self.starter[kort] = [t[0] for t in liste]
+
+    def i_vindu(self, kort: str, start_ts: int, slutt_ts: int) -> List[UtEvent]:
+        liste = self.events.get(kort, [])
+        starter = self.starter.get(kort, [])
+        lo = bisect.bisect_left(starter, start_ts - self.maks_varighet.get(kort, 0))
+        hi = bisect.bisect_left(starter, slutt_ts)
+        enkle = [ut for (_, e, ut) in liste[lo:hi] if e > start_ts]
+        start = datetime.fromtimestamp(start_ts, tz=timezone.utc)
+        slutt = datetime.fromtimestamp(slutt_ts, tz=timezone.utc)
+        return enkle + [ut for ut in self.serier.get(kort, [])
+                        if next(forekomster(ut, start, slutt), None) is not None]
+
+    def ferdig_for(self, kort: str, ts: int) -> List[UtEvent]:
+        liste = self.events.get(kort, [])
+        hi = bisect.bisect_left(self.starter.get(kort, []), ts)
+        enkle = [ut for (_, e, ut) in liste[:hi] if e <= ts]
+        fra = datetime.fromtimestamp(ts, tz=timezone.utc)
+        return enkle + [ut for ut in self.serier.get(kort, [])
+                        if next(forekomster(ut, fra, None), None) is None]
+
+
+def skriv_horisont_filer(
+    indeks: HorisontIndeks,
+    naa: datetime,
+    dry_run: bool,
+    publisering: OutputPublisering,
+) -> List[Tuple[str, int]]:
+    """
+    Skriver vindus- (og ev. arkiv-) filer for hvert fag.
+    Returnerer [(filnavn, antall_events)] for rapporten.
+    """
+    indeks.bygg()
+    naa_ts = int(naa.timestamp())
+    resultat: List[Tuple[str, int]] = []
+
+    vinduer = []
+    for vindu in CONFIG["HORIZON_WINDOWS"]:
+        start_ts = naa_ts - int(timedelta(days=int(vindu["past_days"])).total_seconds())
+        slutt_ts = naa_ts + int(timedelta(days=int(vindu["future_days"])).total_seconds())
+        vinduer.append((vindu["id"], start_ts, slutt_ts))
+    tidligste_start = min((v[1] for v in vinduer), default=naa_ts)
+
+    for _, meta in CONFIG["COURSES"].items():
+        kort = meta["short"]
+        base = meta["file"][: -len(".ics")]
+
+        utvalg = [(f"{base}.{wid}.ics", indeks.i_vindu(kort, start_ts, slutt_ts))
+                  for (wid, start_ts, slutt_ts) in vinduer]
+        if CONFIG["HORIZON_ARCHIVE_ID"]:
+            utvalg.append((f"{base}.{CONFIG['HORIZON_ARCHIVE_ID']}.ics",
+                           indeks.ferdig_for(kort, tidligste_start)))
+
+        for filnavn, events in utvalg:
+            if not dry_run:
+                skriv_kalenderfil(filnavn, events, publisering)
+            resultat.append((filnavn, len(events)))
+
+    return resultat
+
+
+# =============================================================================
+# Opptatt-kalender (intervall-sammenslåing på tvers av alle fag)
+# =============================================================================
+def slaa_sammen_opptatt(
+    events_sorted: Iterable[OutputEventForConflicts],
+) -> List[Tuple[Any, Any]]:
+    """
+    Én strømmende runde over events sortert på start: overlappende (eller
+    kant-i-kant) intervaller slås sammen til minimale opptatt-blokker.
+    """
+    blokker: List[Tuple[Any, Any]] = []
+    start = None
+    slutt = None
+    for ev in events_sorted:
+        if start is not None and ev.begin_local_dt <= slutt:
+            if ev.end_local_dt > slutt:
+                slutt = ev.end_local_dt
+            continue
+        if start is not None:
+            blokker.append((start, slutt))
+        start = ev.begin_local_dt
+        slutt = ev.end_local_dt
+    if start is not None:
+        blokker.append((start, slutt))
+    return blokker
+
+
+def opptatt_events(blokker: List[Tuple[Any, Any]]) -> List[UtEvent]:
+    ut: List[UtEvent] = []
+    for start, slutt in blokker:
+        ut.append(UtEvent(
+            uid=f"opptatt-{_ics_utc(start)}-{_ics_utc(slutt)}",
+            name=CONFIG["FREEBUSY_TITLE"],
+            begin=start,
+            end=slutt,
+            description="",
+            location="",
+        ))
+    return ut
+
+
 # =============================================================================
 # Konfliktdetektor (tvers av ALLE output-kalendere)
 # =============================================================================
+def iter_output_forekomster(
+    enkle_sortert: List[OutputEventForConflicts],
+    serier: List[Tuple[OutputEventForConflicts, UtEvent]],
+) -> Iterator[OutputEventForConflicts]:
+    """
+    Alle beholdte forekomster sortert på start: enkelt-events (allerede sortert)
+    flettes med lat utvidede serier. Minnet vokser med antall serier, ikke
+    antall forekomster.
+    """
+    start, slutt = gjentak_vindu()
+
+    def serie_iter(c: OutputEventForConflicts, ut: UtEvent) -> Iterator[OutputEventForConflicts]:
+        for b, e in forekomster(ut, start, slutt):
+            yield replace(c, begin_local_dt=til_lokal_tid(b), end_local_dt=til_lokal_tid(e))
+
+    kilder: List[Iterable[OutputEventForConflicts]] = [enkle_sortert]
+    kilder.extend(serie_iter(c, ut) for c, ut in serier)
+    return heapq.merge(*kilder, key=lambda e: e.begin_local_dt)
+
+
 def finn_konflikter_pa_tvers(
-    events: List[OutputEventForConflicts],
+    events_sorted: Iterable[OutputEventForConflicts],
     show_max: int,
 ) -> Tuple[int, List[Tuple[OutputEventForConflicts, OutputEventForConflicts]]]:
     """
     Returnerer (antall_konflikter, liste_med_par) der hvert par overlapper i tid.
+    events_sorted må være sortert på start (se iter_output_forekomster).
     Vi informerer bare, vi prøver ikke å “løse” konfliktene.
     """
-    if not events:
-        return (0, [])
-
-    # Sorter på start
-    events_sorted = sorted(events, key=lambda e: e.begin_local_dt)
-
     conflicts: List[Tuple[OutputEventForConflicts,
                           OutputEventForConflicts]] = []
     active: List[OutputEventForConflicts] = []
+    total_conflicts = 0
 
+    # Én runde: tell alle konflikter, men lagre bare de første show_max parene
     for ev in events_sorted:
         # Fjern events som er ferdig før denne starter
         active = [a for a in active if a.end_local_dt > ev.begin_local_dt]
 
         # Alt som fortsatt er "active" overlapper med ev
+        total_conflicts += len(active)
         for a in active:
-            conflicts.append((a, ev))
             if len(conflicts) >= show_max:
-                # vi trenger fortsatt totalt antall, så vi kan ikke stoppe helt her
-                # men vi kan fortsette å telle uten å lagre flere detaljer
-                pass
+                break
+            conflicts.append((a, ev))
 
         active.append(ev)
 
-    total_conflicts = 0
-    # Tell nøyaktig antall konflikter uten å eksplodere minnet:
-    # Vi gjør en ny runde som bare teller.
-    active = []
-    for ev in events_sorted:
-        active = [a for a in active if a.end_local_dt > ev.begin_local_dt]
-        total_conflicts += len(active)
-        active.append(ev)
+    return (total_conflicts, conflicts)
+
+
+# =============================================================================
+# Rombelegg (ROOM_REPORT / ROOM_FREE_QUERIES)
+# =============================================================================
+class RomIndeks:
+    """
+    Beholdte forekomster per rom (bygg, rom), sortert på start, med løpende
+    maks sluttid. "Er rommet ledig ved T?" er da ett binærsøk: rommet er opptatt
+    hvis noe som startet før/ved T fortsatt pågår, dvs. maks sluttid > T.
+    """
+
+    def __init__(self) -> None:
+        self.rom: Dict[Tuple[str, str], List[OutputEventForConflicts]] = {}
+        self.starter: Dict[Tuple[str, str], List[Any]] = {}
+        # Indeks (i rommets liste) til eventet med størst sluttid så langt
+        self.lengst: Dict[Tuple[str, str], List[int]] = {}
+
+    def legg_til(self, c: OutputEventForConflicts) -> None:
+        # Forventer sortert input (iter_output_forekomster); rom vi ikke fant hoppes over
+        if c.rom_funnet:
+            self.rom.setdefault((c.bygg, c.location), []).append(c)
+
+    def bygg(self) -> None:
+        for nokkel, liste in self.rom.items():
+            self.starter[nokkel] = [c.begin_local_dt for c in liste]
+            lengst: List[int] = []
+            for i, c in enumerate(liste):
+                if not lengst or c.end_local_dt > liste[lengst[-1]].end_local_dt:
+                    lengst.append(i)
+                else:
+                    lengst.append(lengst[-1])
+            self.lengst[nokkel] = lengst
+
+    def finn_rom(self, rom: str, bygg: str = "") -> List[Tuple[str, str]]:
+        return [n for n in self.rom if n[1] == rom and (not bygg or n[0] == bygg)]
+
+    def opptatt_ved(self, nokkel: Tuple[str, str], t: Any) -> Optional[OutputEventForConflicts]:
+        """Eventet som holder rommet opptatt ved t, eller None hvis ledig. O(log n)."""
+        hi = bisect.bisect_right(self.starter.get(nokkel, []), t)
+        if hi == 0:
+            return None
+        kandidat = self.rom[nokkel][self.lengst[nokkel][hi - 1]]
+        return kandidat if kandidat.end_local_dt > t else None
+
+    def dobbeltbookinger(
+        self, show_max: int,
+    ) -> List[Tuple[Tuple[str, str], int, List[Tuple[OutputEventForConflicts, OutputEventForConflicts]]]]:
+        """[(rom, antall_par, eksempelpar)] for rom med overlappende events."""
+        resultat = []
+        for nokkel in sorted(self.rom):
+            antall, par = finn_konflikter_pa_tvers(self.rom[nokkel], show_max)
+            if antall:
+                resultat.append((nokkel, antall, par))
+        return resultat
+
+    def timer_per_uke(self, nokkel: Tuple[str, str]) -> Dict[Tuple[int, int], float]:
+        """Timer rommet er i bruk per ISO-uke (overlappende events telles én gang)."""
+        uker: Dict[Tuple[int, int], float] = {}
+
+        def legg_til_blokk(b: Any, e: Any) -> None:
+            uke = tuple(b.isocalendar())[:2]
+            uker[uke] = uker.get(uke, 0.0) + (e - b).total_seconds() / 3600
+
+        blokk_start = blokk_slutt = None
+        for c in self.rom.get(nokkel, []):
+            if blokk_start is not None and c.begin_local_dt < blokk_slutt:
+                blokk_slutt = max(blokk_slutt, c.end_local_dt)
+                continue
+            if blokk_start is not None:
+                legg_til_blokk(blokk_start, blokk_slutt)
+            blokk_start, blokk_slutt = c.begin_local_dt, c.end_local_dt
+        if blokk_start is not None:
+            legg_til_blokk(blokk_start, blokk_slutt)
+        return uker
+
+
+def _romnavn(nokkel: Tuple[str, str]) -> str:
+    bygg, rom = nokkel
+    return f"{bygg} {rom}".strip()
+
+
+# =============================================================================
+# Vektorisert tid/overlapp (VECTORIZED, krever numpy)
+# =============================================================================
+def bruk_vektorisert(antall: int) -> bool:
+    if np is None or CONFIG["VECTORIZED"] == "off":
+        return False
+    return CONFIG["VECTORIZED"] == "on" or antall >= CONFIG["VECTORIZE_MIN_EVENTS"]
+
+
+def finn_konflikter_valgt(
+    events_sorted: Iterable[OutputEventForConflicts],
+    show_max: int,
+) -> Tuple[int, List[Tuple[OutputEventForConflicts, OutputEventForConflicts]]]:
+    """
+    Konfliktsjekk med sveip eller numpy etter VECTORIZED. I "auto" telles
+    forekomstene (serier medregnet) mot VECTORIZE_CONFLICTS_MIN_EVENTS; det
+    leses aldri mer enn grensen inn før valget er tatt, så sveipen går fortsatt
+    med lite minne for vanlige kalendere.
+    """
+    if np is None or CONFIG["VECTORIZED"] == "off":
+        return finn_konflikter_pa_tvers(events_sorted, show_max)
+    if CONFIG["VECTORIZED"] == "on":
+        return finn_konflikter_vektorisert(events_sorted, show_max)
+    resten = iter(events_sorted)
+    grense = CONFIG["VECTORIZE_CONFLICTS_MIN_EVENTS"]
+    forste = list(itertools.islice(resten, grense))
+    if len(forste) < grense:
+        return finn_konflikter_pa_tvers(forste, show_max)
+    return finn_konflikter_vektorisert(itertools.chain(forste, resten), show_max)
+
+
+def _epoker_us(tider: List[Any]) -> Any:
+    """Aware datetimes -> int64 mikrosekunder siden 1970 (eksakt, ingen float)."""
+    return np.fromiter(((t - EPOKE_UTC) // MIKROSEKUND for t in tider),
+                       dtype=np.int64, count=len(tider))
+
+
+def _veggklokke_us(tider: List[Any]) -> Any:
+    """
+    Lokal veggklokke som int64 mikrosekunder (fra år 1). Slik sammenligner Python
+    datetimes med samme tzinfo, så rekkefølgen blir identisk med sveipen.
+    """
+    return np.fromiter(
+        ((t.toordinal() * 86400 + t.hour * 3600 + t.minute * 60 + t.second) * 1_000_000
+         + t.microsecond for t in tider),
+        dtype=np.int64, count=len(tider))
+
+
+def _lokale_offset(epoker: Any) -> Any:
+    """
+    UTC-offset (sekunder) i LOCAL_TZ for hver epoke: finner offset-skiftene i
+    intervallet én gang og slår så opp alle epoker med ett searchsorted.
+    """
+    overganger, offsets = _offset_overganger(int(epoker.min()), int(epoker.max()))
+    indeks = np.searchsorted(np.array(overganger, dtype=np.int64), epoker, side="right") - 1
+    return np.array(offsets, dtype=np.int64)[indeks]
+
+
+def _lokale_kolonner(tider: List[datetime]) -> Tuple[Any, Any]:
+    """(ukedag 0=man, minutter etter lokal midnatt) som int64-kolonner."""
+    sek = _epoker_us(tider) // 1_000_000
+    lokal = sek + _lokale_offset(sek)
+    dag, rest = np.divmod(lokal, 86400)
+    return ((dag + 3) % 7, rest // 60)  # 1970-01-01 var en torsdag
+
+
+def vektor_tidstreff(
+    events: List[KildeEvent],
+    filtre: List[Tuple[str, Dict[str, Any], List[Tuple[str, Any]]]],
+    kompilert: bool,
+) -> List[Optional[FrozenSet[str]]]:
+    """
+    weekday/start_time/end_time for alle enkelt-events på én gang.
+    Returnerer per event (samme rekkefølge) Regel-ID-ene der alle tidsklausuler
+    holder, til bruk i filtrer_bort_event(). Serier (RRULE) får None og filtreres
+    per forekomst som før.
+    """
+    prof = PROFIL
+    t_start = time.perf_counter() if prof is not None else 0.0
+    enkle = [i for i, e in enumerate(events) if not e.rrule]
+    res: List[Optional[FrozenSet[str]]] = [None] * len(events)
+    if not enkle:
+        return res
+
+    ukedag, start_min = _lokale_kolonner([events[i].begin for i in enkle])
+    _, slutt_min = _lokale_kolonner([events[i].end for i in enkle])
+
+    rids: List[str] = []
+    masker = []
+    regel_tid: List[float] = []
+    for rid, _regel, klausuler in filtre:
+        tid = [(f, v) for f, v in klausuler if f in FILTER_TIDSFELT]
+        if not tid:
+            continue
+        t_regel = time.perf_counter() if prof is not None else 0.0
+        maske = np.ones(len(enkle), dtype=bool)
+        for felt, verdi in tid:
+            if not kompilert:
+                verdi = _forbered_klausul(felt, verdi)
+            if felt == "weekday":
+                maske &= ukedag == verdi
+            elif felt == "start_time":
+                maske &= start_min == verdi[0] * 60 + verdi[1]
+            else:
+                maske &= slutt_min == verdi[0] * 60 + verdi[1]
+        rids.append(rid)
+        masker.append(maske)
+        if prof is not None:
+            regel_tid.append(time.perf_counter() - t_regel)
+
+    if not masker:
+        tom: FrozenSet[str] = frozenset()
+        for i in enkle:
+            res[i] = tom
+        return res
+
+    # Få distinkte kombinasjoner: ett frozenset per kombinasjon, delt mellom eventene
+    koder = np.zeros(len(enkle), dtype=object if len(rids) > 62 else np.int64)
+    for bit, maske in enumerate(masker):
+        koder += maske.astype(koder.dtype) << bit
+    unike, indeks = np.unique(koder, return_inverse=True)
+    sett = [frozenset(rid for bit, rid in enumerate(rids) if (int(k) >> bit) & 1)
+            for k in unike.tolist()]
+    for i, k in zip(enkle, indeks.tolist()):
+        res[i] = sett[k]
+
+    if prof is not None:
+        # Kolonner og kombinasjoner deles likt mellom reglene, så summen blir
+        # hele tiden i vektor_tidstreff (og reglene havner i topplista)
+        felles = (time.perf_counter() - t_start - sum(regel_tid)) / len(rids)
+        for rid, maske, sek in zip(rids, masker, regel_tid):
+            treff = int(np.count_nonzero(maske))
+            prof.registrer("klausul", f"{rid}.tid (vektorisert)", sek + felles,
+                           treff, evalueringer=len(enkle))
+            prof.registrer("EVENT_FILTERS", rid, sek + felles, 0, evalueringer=0)
+    return res
+
+
+def finn_konflikter_vektorisert(
+    events_sorted: Iterable[OutputEventForConflicts],
+    show_max: int,
+) -> Tuple[int, List[Tuple[OutputEventForConflicts, OutputEventForConflicts]]]:
+    """
+    Samme svar som finn_konflikter_pa_tvers(), regnet på kolonner: event j er i
+    konflikt med alle tidligere i som slutter etter at j starter, dvs.
+    j - #{i: slutt_i <= start_j} (ett binærsøk per event mot sorterte sluttider).
+    """
+    liste = list(events_sorted)
+    if not liste:
+        return (0, [])
+    sone = liste[0].begin_local_dt.tzinfo
+    if any(e.begin_local_dt.tzinfo is not sone or e.end_local_dt.tzinfo is not sone
+           for e in liste):
+        # Blandede tidssoner sammenlignes som UTC-tidspunkt; bruk sveipen
+        return finn_konflikter_pa_tvers(liste, show_max)
+    start = _veggklokke_us([e.begin_local_dt for e in liste])
+    slutt = _veggklokke_us([e.end_local_dt for e in liste])
+    if bool(np.any(slutt <= start)):
+        # Null/negativ varighet bryter tellingen over; bruk sveipen
+        return finn_konflikter_pa_tvers(liste, show_max)
+
+    ferdige = np.searchsorted(np.sort(slutt), start, side="right")
+    aktive = np.arange(len(liste), dtype=np.int64) - ferdige
+    total_conflicts = int(aktive.sum())
+
+    # Eksempelpar i samme rekkefølge som sveipen
+    conflicts: List[Tuple[OutputEventForConflicts,
+                          OutputEventForConflicts]] = []
+    for j in np.nonzero(aktive > 0)[0].tolist():
+        if len(conflicts) >= show_max:
+            break
+        for i in np.nonzero(slutt[:j] > start[j])[0].tolist():
+            if len(conflicts) >= show_max:
+                break
+            conflicts.append((liste[i], liste[j]))
+
+    return (total_conflicts, conflicts)
+
 
-    # Begrens detaljlisten til show_max
-    return (total_conflicts, conflicts[:show_max])
+def benchmark_vektorisert(storrelser: Tuple[int, ...] = (100, 300, 1000, 3000, 10000, 20000, 30000)) -> None:
+    """
+    Syntetiske events (fast seed): Python-sti mot numpy-sti for tidsfiltre og
+    konfliktsjekk. Sjekker at svarene er like og viser hvor numpy blir raskest.
+    """
+    if np is None:
+        _die("Benchmark krever numpy: pip install numpy")
+
+    filtre = [
+        ("bench-man-1215", {}, [("weekday", 0), ("start_time", (12, 15))]),
+        ("bench-slutt-1600", {}, [("end_time", (16, 0))]),
+        ("bench-fre", {}, [("weekday", 4)]),
+    ]
+    rng = random.Random(4100)
+    semesterstart = datetime(2026, 1, 5, 7, 0, tzinfo=timezone.utc)
+
+    def best_av_3(fn: Any) -> Tuple[float, Any]:
+        beste, svar = float("inf"), None
+        for _ in range(3):
+            t0 = time.perf_counter()
+            svar = fn()
+            beste = min(beste, time.perf_counter() - t0)
+        return (beste, svar)
+
+    def python_tidstreff(events: List[KildeEvent]) -> List[FrozenSet[str]]:
+        ut = []
+        for e in events:
+            k = FilterKontekst(fagkode="", title="", loc="",
+                               begin_local=til_lokal_tid(e.begin),
+                               end_local=til_lokal_tid(e.end))
+            ut.append(frozenset(rid for rid, _, kl in filtre
+                                if _klausuler_treffer(rid, kl, k, FILTER_TESTER_KOMPILERT)))
+        return ut
+
+    print(f"{'events':>8} | {'filter py':>10} {'filter np':>10} | "
+          f"{'konflikt py':>11} {'konflikt np':>11} | konflikter")
+    print("-" * 72)
+    grense_filter: Optional[int] = None
+    grense_konflikt: Optional[int] = None
+    for n in storrelser:
+        events = []
+        for i in range(n):
+            b = semesterstart + timedelta(days=rng.randrange(140),
+                                          minutes=15 * rng.randrange(44))
+            e = b + timedelta(minutes=rng.choice((45, 90, 105, 135, 225)))
+            events.append(KildeEvent(uid=str(i), name="", location="", description="",
+                                     begin=b, end=e))
+
+        t_fpy, svar_py = best_av_3(lambda: python_tidstreff(events))
+        t_fnp, svar_np = best_av_3(lambda: vektor_tidstreff(events, filtre, kompilert=True))
+        if svar_py != svar_np:
+            _die(f"Benchmark: tidsfiltre gir ulikt svar for {n} events.")
+
+        konflikt_events = sorted(
+            (OutputEventForConflicts(short_code="", begin_local_dt=til_lokal_tid(e.begin),
+                                     end_local_dt=til_lokal_tid(e.end), title=e.uid, location="")
+             for e in events),
+            key=lambda c: c.begin_local_dt)
+        t_kpy, k_py = best_av_3(lambda: finn_konflikter_pa_tvers(konflikt_events, 10))
+        t_knp, k_np = best_av_3(lambda: finn_konflikter_vektorisert(konflikt_events, 10))
+        if k_py != k_np:
+            _die(f"Benchmark: konfliktsjekk gir ulikt svar for {n} events.")
+
+        if grense_filter is None and t_fnp < t_fpy:
+            grense_filter = n
+        if grense_konflikt is None and t_knp < t_kpy:
+            grense_konflikt = n
+        print(f"{n:>8} | {t_fpy * 1000:8.2f}ms {t_fnp * 1000:8.2f}ms | "
+              f"{t_kpy * 1000:9.2f}ms {t_knp * 1000:9.2f}ms | {k_py[0]}")
+
+    print("-" * 72)
+    for navn, grense in (("Tidsfiltre", grense_filter), ("Konfliktsjekk", grense_konflikt)):
+        if grense is None:
+            print(f"{navn}: numpy var ikke raskere for noen av størrelsene.")
+        else:
+            print(f"{navn}: numpy raskest fra ca. {grense} events.")
+    print(f"(VECTORIZE_MIN_EVENTS er nå {CONFIG['VECTORIZE_MIN_EVENTS']}, "
+          f"VECTORIZE_CONFLICTS_MIN_EVENTS {CONFIG['VECTORIZE_CONFLICTS_MIN_EVENTS']})")
 
 
 # =============================================================================
@@ -732,12 +2862,21 @@ def print_report(
     conflict_samples: List[Tuple[OutputEventForConflicts, OutputEventForConflicts]],
     per_calendar_counts: Dict[str, int],
     dry_run: bool,
+    duplicates_by_source: Optional[Dict[str, int]] = None,
+    rom: Optional[RomIndeks] = None,
 ) -> None:
-    total = len(report)
-    matched = sum(1 for r in report if r.course_code is not None)
+    # Forekomster som er filtrert ut av en serie er ikke egne events i feeden,
+    # og telles for seg så totalene stemmer med antall VEVENT.
+    events = [r for r in report if not r.flags.occurrence]
+    total = len(events)
+    matched = sum(1 for r in events if r.course_code is not None)
     unmatched = total - matched
 
-    filtered_out = sum(1 for r in report if r.flags.filtered_out)
+    filtered_out = sum(1 for r in events if r.flags.filtered_out)
+    occurrences_filtered = sum(1 for r in report if r.flags.occurrence)
+    recurring = sum(1 for r in report if (
+        r.flags.recurring and not r.flags.filtered_out and not r.flags.duplicate))
+    duplicates = sum(1 for r in report if r.flags.duplicate)
 
     title_changed = sum(1 for r in report if r.flags.title_changed)
     location_changed = sum(1 for r in report if r.flags.location_changed)
@@ -758,6 +2897,12 @@ def print_report(
     print(f"Matchet mot COURSES:              {matched}")
     print(f"IKKE matchet (sjekk nye fag?):    {unmatched}")
     print(f"Filtrert bort (bevisst regel):    {filtered_out}")
+    if occurrences_filtered:
+        print(f"Forekomster filtrert bort (serier): {occurrences_filtered}")
+    if duplicates:
+        print(f"Duplikater på tvers av feeder:    {duplicates}")
+    if recurring:
+        print(f"Gjentakende serier (RRULE):       {recurring}")
     print("-" * 72)
     print(f"Tittel endret (SUMMARY):          {title_changed}")
     print(f"Lokasjon endret (LOCATION):       {location_changed}")
@@ -807,7 +2952,7 @@ def print_report(
             print(f"  reason: {st.reason}")
         print()
 
-    if filtered_out:
+    if filtered_out or occurrences_filtered:
         print("[5] Events som ble FILTRERT BORT (bevisst regel):")
         for r in report:
             if r.flags.filtered_out:
@@ -836,11 +2981,55 @@ def print_report(
                     f"- ... og {conflict_total - len(conflict_samples)} til.")
             print()
 
+    if duplicates:
+        print("[6b] Duplikater på tvers av feeder (tatt med fra første feed):")
+        for kilde, antall in sorted((duplicates_by_source or {}).items()):
+            print(f"- {kilde}: {antall}")
+        print()
+
+    if rom is not None and CONFIG["ROOM_REPORT"]:
+        dobbelt = rom.dobbeltbookinger(CONFIG["CONFLICTS_SHOW_MAX"])
+        print(f"[6c] Rombelegg ({len(rom.rom)} rom):")
+        if not dobbelt:
+            print("- Ingen dobbeltbookede rom.")
+        for nokkel, antall, par in dobbelt:
+            print(f"- DOBBELTBOOKET: {_romnavn(nokkel)} ({antall} overlapp)")
+            for a, b in par:
+                print(f"  {a.begin_local_dt.strftime('%Y-%m-%d %H:%M')}–{a.end_local_dt.strftime('%H:%M')} "
+                      f"[{a.short_code}] {a.title}  <->  "
+                      f"{b.begin_local_dt.strftime('%H:%M')}–{b.end_local_dt.strftime('%H:%M')} "
+                      f"[{b.short_code}] {b.title}")
+        print(f"  Timer i bruk per uke (100 % = {CONFIG['ROOM_WEEK_HOURS']:g} t):")
+        for nokkel in sorted(rom.rom):
+            uker = rom.timer_per_uke(nokkel)
+            deler = [f"uke {u}/{aar}: {t:.1f} t ({t / CONFIG['ROOM_WEEK_HOURS'] * 100:.0f} %)"
+                     for (aar, u), t in sorted(uker.items())]
+            print(f"  - {_romnavn(nokkel)}: " + ", ".join(deler))
+        print()
+
+    if rom is not None and CONFIG["ROOM_FREE_QUERIES"]:
+        print("[6d] Er rommet ledig?")
+        for sporring in CONFIG["ROOM_FREE_QUERIES"]:
+            t = datetime.strptime(str(sporring["at"]), ROM_TID_FORMAT).replace(tzinfo=LOCAL_TZ)
+            treff = rom.finn_rom(sporring["room"].strip(), str(sporring.get("building") or "").strip())
+            hva = f"{sporring['room']} {sporring['at']}"
+            if not treff:
+                print(f"- {hva}: ledig (ingen av dine events bruker dette rommet)")
+            for nokkel in treff:
+                c = rom.opptatt_ved(nokkel, t)
+                if c is None:
+                    print(f"- {_romnavn(nokkel)} {sporring['at']}: ledig")
+                else:
+                    print(f"- {_romnavn(nokkel)} {sporring['at']}: OPPTATT "
+                          f"({c.begin_local_dt.strftime('%H:%M')}–{c.end_local_dt.strftime('%H:%M')} "
+                          f"[{c.short_code}] {c.title})")
+        print("→ Gjelder bare events i dine output-kalendere, ikke hele TP.\n")
+
     # Eksempel-linjer
     print("[7] Eksempel-linjer (før -> etter) for de første 10 matchede events:")
     shown = 0
     for r in report:
-        if r.course_code is None or r.flags.filtered_out:
+        if r.course_code is None or r.flags.filtered_out or r.flags.duplicate:
             continue
         print(f"- {r.course_code} | {r.begin_local}–{r.end_local}")
         print(f"  Tittel:   '{r.old_title}' -> '{r.new_title}'")
@@ -849,6 +3038,26 @@ def print_report(
         if shown >= 10:
             break
 
+    # Profilering (kun når PROFILING=True)
+    if PROFIL is not None:
+        n = CONFIG["PROFILE_SHOW_MAX"]
+        print(f"\n[8] Profilering – dyreste regler (viser inntil {n} per kategori):")
+        for kategori, tittel in (
+            ("TYPE_RULES", "TYPE_RULES-mønstre"),
+            ("EVENT_FILTERS", "EVENT_FILTERS-regler"),
+            ("klausul", "EVENT_FILTERS-klausuler"),
+        ):
+            topp = PROFIL.dyreste(kategori, n)
+            print(f"  {tittel}:")
+            if not topp:
+                print("  - (ingen evalueringer)")
+            for k in topp:
+                snitt_us = (k.sekunder / k.evalueringer) * 1e6 if k.evalueringer else 0.0
+                print(
+                    f"  - {k.sekunder * 1000:8.3f} ms  {k.evalueringer:6d} eval  "
+                    f"{k.treff:6d} treff  {snitt_us:7.2f} µs/eval  {k.navn}")
+        print()
+
     # Pretty summary
     if CONFIG.get("PRETTY_SUMMARY", True):
         print("\n" + "=" * 72)
@@ -872,6 +3081,8 @@ def print_report(
         print("-" * 72)
         print(f"DEFAULT_TYPE brukt: {used_default}")
         print(f"Rom-parse-feil:     {room_parse_failed}")
+        if duplicates:
+            print(f"Duplikater:         {duplicates}")
         print(f"Konflikter totalt:  {conflict_total}")
         print("=" * 72)
 
@@ -879,27 +3090,335 @@ def print_report(
 
 
 # =============================================================================
-# main
+# Golden-filer: regresjon (byte for byte) + events/sekund per motor
 # =============================================================================
-def main() -> None:
-    # Fail fast: valider config før vi gjør noe
-    if CONFIG["FAIL_FAST"]:
-        validate_config_fail_fast()
+class _OpptattFeedRespons:
+    """Minimal stand-in for requests.Response, servert fra en innspilt feed."""
 
-    # Last ned ICS
-    ics_text = download_ics_text_fail_fast() if CONFIG["FAIL_FAST"] else None
-    if ics_text is None:
-        print("Laster ned kalender fra TP …")
-        resp = requests.get(CONFIG["ICS_URL"], timeout=30)
-        resp.raise_for_status()
-        ics_text = resp.text
+    def __init__(self, innhold: bytes):
+        self.status_code = 200
+        self.headers = {"Content-Type": "text/calendar; charset=utf-8"}
+        self.content = innhold
+        self.encoding = "utf-8"
+        self.text = innhold.decode("utf-8")
 
-    kilde = Calendar(ics_text)
+    def raise_for_status(self) -> None:
+        pass
 
-    # Tom kalender for hver kortkode
-    utkalendere: Dict[str, Calendar] = {}
-    for _, meta in CONFIG["COURSES"].items():
-        utkalendere[meta["short"]] = Calendar()
+    def iter_content(self, chunk_size: int = 1, decode_unicode: bool = False) -> Iterator[bytes]:
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "_OpptattFeedRespons":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+def _les_mappe(mappe: str) -> Dict[str, bytes]:
+    filer: Dict[str, bytes] = {}
+    for rot, undermapper, navn in os.walk(mappe):
+        undermapper[:] = [d for d in undermapper if not d.startswith(".")]
+        for n in navn:
+            sti = os.path.join(rot, n)
+            with open(sti, "rb") as f:
+                filer[os.path.relpath(sti, mappe).replace(os.sep, "/")] = f.read()
+    return filer
+
+
+def _vevent_sett(data: bytes) -> List[Tuple[str, ...]]:
+    """
+    VEVENT-ene i en .ics som sammenlignbare verdier: linjer foldes ut (på bytes,
+    så en fold midt i et UTF-8-tegn ikke ødelegger det), linjene i hver VEVENT
+    sorteres og VEVENT-ene sorteres. PRODID og annet utenfor VEVENT ignoreres.
+    """
+    tekst = re.sub(rb"\r?\n[ \t]", b"", data).decode("utf-8", errors="replace")
+    events: List[Tuple[str, ...]] = []
+    gjeldende: Optional[List[str]] = None
+    for linje in tekst.splitlines():
+        if linje == "BEGIN:VEVENT":
+            gjeldende = []
+        elif linje == "END:VEVENT" and gjeldende is not None:
+            events.append(tuple(sorted(gjeldende)))
+            gjeldende = None
+        elif gjeldende is not None and linje:
+            gjeldende.append(linje)
+    return sorted(events)
+
+
+def _sammenlign_motorer(output_per_motor: Dict[str, Dict[str, bytes]]) -> List[str]:
+    """
+    Motorene skriver ulike bytes (PRODID, folding, rekkefølge), men skal gi de
+    samme VEVENT-ene. Returnerer "<motor>:<fil>" for hver .ics som avviker fra
+    første motor.
+    """
+    motorer = list(output_per_motor)
+    if len(motorer) < 2:
+        return []
+    ref = output_per_motor[motorer[0]]
+    ulike: List[str] = []
+    for motor in motorer[1:]:
+        annen = output_per_motor[motor]
+        for navn in sorted(n for n in set(ref) | set(annen) if n.endswith(".ics")):
+            if navn not in ref or navn not in annen \
+                    or _vevent_sett(ref[navn]) != _vevent_sett(annen[navn]):
+                ulike.append(f"{motor}:{navn}")
+    return ulike
+
+
+def golden_kjoring(mappe: str, oppdater: bool, repetisjoner: int = 3) -> None:
+    """
+    Kjører main() offline mot en innspilt feed (samme filnavn som i SNAPSHOT_DIR:
+    feed.ics + feed.<id>.ics) for hver variant i GOLDEN_VARIANTER, med låst "nå".
+    Output sammenlignes byte for byte med <mappe>/golden-<motor>/; med oppdater=True
+    skrives golden-filene på nytt i stedet. Skriver events/sekund per variant.
+    Til slutt sjekkes det at motorene gir de samme VEVENT-ene (_sammenlign_motorer).
+    Har feeden serier i lokal tid, hoppes ics-variantene over (motoren støtter dem ikke).
+    """
+    global FAST_NAA
+    feeds: Dict[str, bytes] = {}
+    lokale_serier = 0
+    for kilde, url in ics_kilder():
+        sti = os.path.join(mappe, _snapshot_feed_fil(kilde))
+        if not os.path.isfile(sti):
+            _die(
+                f"GOLDEN: Fant ikke innspilt feed '{sti}'.\n"
+                "Kopier feed-filene fra SNAPSHOT_DIR (SNAPSHOT_ENABLED=True) hit.")
+        with open(sti, "rb") as f:
+            feeds[url] = f.read()
+        lokale_serier += sum(
+            1 for ev in kilde_events_fra_ics(feeds[url].decode("utf-8"), kilde)
+            if ev.rrule and ev.tid_lokal)
+    antall_events = sum(raw.count(b"BEGIN:VEVENT") for raw in feeds.values())
+
+    # ics-motoren kan ikke skrive serier i lokal tid (TZID); hopp over den da
+    varianter = [(motor, kompilert) for motor, kompilert in GOLDEN_VARIANTER
+                 if not (lokale_serier and motor == "ics")]
+
+    meta_sti = os.path.join(mappe, GOLDEN_META_FILE)
+    if oppdater:
+        naa = naa_utc().replace(microsecond=0)
+    else:
+        if not os.path.isfile(meta_sti):
+            _die(f"GOLDEN: Fant ikke '{meta_sti}'. Kjør først med --golden-oppdater {mappe}")
+        with open(meta_sti, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != GOLDEN_FORMAT:
+            _die("GOLDEN: golden.json har ukjent format. Kjør --golden-oppdater på nytt.")
+        naa = datetime.fromisoformat(meta["now"])
+
+    def stub_get(url: str, *args: Any, **kwargs: Any) -> _OpptattFeedRespons:
+        if url not in feeds:
+            raise RuntimeError(f"GOLDEN: nettverk er slått av (ukjent URL: {url})")
+        return _OpptattFeedRespons(feeds[url])
+
+    original_config = dict(CONFIG)
+    original_get = requests.get
+    original_cwd = os.getcwd()
+    mappe_abs = os.path.abspath(mappe)
+    avvik = 0
+    output_per_motor: Dict[str, Dict[str, bytes]] = {}
+    print(f"GOLDEN: {antall_events} events i innspilt feed, nå = {naa.isoformat()}")
+    if lokale_serier:
+        print(f"GOLDEN: {lokale_serier} serie(r) i lokal tid (TZID); hopper over "
+              "ics-variantene og sammenligningen mellom motorene.")
+    try:
+        requests.get = stub_get
+        FAST_NAA = naa
+        for motor, kompilert in varianter:
+            CONFIG.update({
+                "OUTPUT_ENGINE": motor,
+                "COMPILED_RULES": kompilert,
+                "DRY_RUN": False,
+                "REPLAY_FROM_SNAPSHOT": False,
+                "SNAPSHOT_ENABLED": False,
+                "OUTPUT_MANIFEST_FILE": "",
+                "METRICS_FILE": "",
+                "PROFILING": False,
+            })
+            variant = f"{motor}/{'kompilert' if kompilert else 'naiv'}"
+            golden_mappe = os.path.join(mappe_abs, f"golden-{motor}")
+
+            beste = float("inf")
+            output: Dict[str, bytes] = {}
+            for _ in range(max(1, repetisjoner)):
+                arbeid = tempfile.mkdtemp(prefix="split_tp_golden_")
+                try:
+                    os.chdir(arbeid)
+                    t0 = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        main([])
+                    beste = min(beste, time.perf_counter() - t0)
+                    output = _les_mappe(arbeid)
+                finally:
+                    os.chdir(original_cwd)
+                    shutil.rmtree(arbeid, ignore_errors=True)
+
+            output_per_motor.setdefault(motor, output)
+            fart = antall_events / beste if beste > 0 else 0.0
+            if oppdater:
+                if kompilert:
+                    shutil.rmtree(golden_mappe, ignore_errors=True)
+                    for navn, data in output.items():
+                        sti = os.path.join(golden_mappe, *navn.split("/"))
+                        os.makedirs(os.path.dirname(sti), exist_ok=True)
+                        with open(sti, "wb") as f:
+                            f.write(data)
+                status = f"skrevet ({len(output)} filer)" if kompilert else "-"
+            else:
+                forventet = _les_mappe(golden_mappe) if os.path.isdir(golden_mappe) else {}
+                ulike = sorted(
+                    n for n in set(forventet) | set(output) if forventet.get(n) != output.get(n))
+                avvik += len(ulike)
+                status = "OK" if not ulike else "AVVIK: " + ", ".join(ulike)
+            print(f" - {variant:<16} {beste * 1000:8.1f} ms  {fart:10.0f} events/s  {status}")
+    finally:
+        requests.get = original_get
+        FAST_NAA = None
+        CONFIG.clear()
+        CONFIG.update(original_config)
+
+    motor_avvik = _sammenlign_motorer(output_per_motor)
+    if len(output_per_motor) > 1:
+        print(" - motorer like:     " + (
+            "OK" if not motor_avvik else "AVVIK: " + ", ".join(motor_avvik)))
+    if motor_avvik:
+        _die(f"GOLDEN: {len(motor_avvik)} fil(er) har ulike VEVENT-er mellom motorene "
+             f"({', '.join(output_per_motor)}).")
+
+    if oppdater:
+        for motor in {m for m, _ in GOLDEN_VARIANTER} - {m for m, _ in varianter}:
+            shutil.rmtree(os.path.join(mappe_abs, f"golden-{motor}"), ignore_errors=True)
+        with open(meta_sti, "w", encoding="utf-8") as f:
+            json.dump({"format": GOLDEN_FORMAT, "now": naa.isoformat()}, f, indent=2)
+            f.write("\n")
+        print(f"GOLDEN: golden-filer oppdatert i '{mappe}'.")
+    elif avvik:
+        _die(f"GOLDEN: {avvik} fil(er) avviker fra golden-output.")
+    else:
+        print("GOLDEN: all output er identisk med golden-filene.")
+
+
+# =============================================================================
+# main
+# =============================================================================
+BRUK = ("Bruk: python split_tp_calendar.py [--config <fil.toml|fil.json>] "
+        "[--benchmark-vektor | --golden <mappe> | --golden-oppdater <mappe>]")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    global METRIKK
+    args = list(sys.argv[1:] if argv is None else argv)
+    modus: Optional[str] = None
+    modus_mappe = ""
+    i = 0
+    while i < len(args):
+        if args[i] == "--benchmark-vektor" and modus is None:
+            modus = args[i]
+            i += 1
+        elif args[i] in ("--golden", "--golden-oppdater") and modus is None and i + 1 < len(args):
+            modus, modus_mappe = args[i], args[i + 1]
+            i += 2
+        elif args[i] == "--config" and i + 1 < len(args):
+            aktiver_config(last_config_fil(args[i + 1]))
+            i += 2
+        else:
+            _die(BRUK)
+
+    if modus == "--benchmark-vektor":
+        benchmark_vektorisert()
+        return
+    if modus is not None:
+        golden_kjoring(modus_mappe, oppdater=(modus == "--golden-oppdater"))
+        return
+
+    if CONFIG["METRICS_FILE"]:
+        METRIKK = KjoreMetrikker()
+        suksess = False
+        try:
+            kjor_med_profilering()
+            suksess = True
+        finally:
+            METRIKK.lagre(CONFIG["METRICS_FILE"], suksess)
+            METRIKK = None
+        return
+
+    kjor_med_profilering()
+
+
+def kjor_med_profilering() -> None:
+    global PROFIL
+    if not CONFIG["PROFILING"]:
+        kjor()
+        return
+
+    PROFIL = RegelProfil()
+    if not CONFIG["PROFILE_PSTATS_FILE"]:
+        kjor()
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        kjor()
+    finally:
+        profiler.disable()
+        profiler.dump_stats(CONFIG["PROFILE_PSTATS_FILE"])
+        print(f"cProfile: statistikk skrevet til {CONFIG['PROFILE_PSTATS_FILE']}")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+
+def kjor() -> None:
+    global BUNT
+    # Fail fast: valider config før vi gjør noe (hoppes over ved cache-treff)
+    if CONFIG["COMPILED_RULES"]:
+        BUNT = last_eller_bygg_regel_bunt()
+    else:
+        BUNT = None
+        if CONFIG["FAIL_FAST"]:
+            validate_config_fail_fast()
+    if METRIKK is not None:
+        METRIKK.steg("config")
+
+    if CONFIG["REPLAY_FROM_SNAPSHOT"]:
+        # Replay: ingen nett, ingen ny parsing
+        kilde_events = last_snapshot_fail_fast()
+        if METRIKK is not None:
+            METRIKK.steg("replay")
+    else:
+        # Last ned ICS (ICS_URL + ev. EXTRA_ICS_FEEDS)
+        feeds: List[Tuple[str, str]] = []
+        kilde_events = []
+        for kilde, url in ics_kilder():
+            t_fetch = time.perf_counter()
+            if CONFIG["FAIL_FAST"]:
+                ics_text, antall_bytes = download_ics_text_fail_fast(url, kilde)
+            else:
+                print("Laster ned kalender fra TP …")
+                resp = requests.get(url, timeout=30)
+                resp.raise_for_status()
+                ics_text, antall_bytes = resp.text, len(resp.content)
+            if METRIKK is not None:
+                METRIKK.sett("fetch_duration_seconds",
+                             time.perf_counter() - t_fetch, feed=kilde)
+                METRIKK.sett("fetch_body_bytes", antall_bytes, feed=kilde)
+            feeds.append((kilde, ics_text))
+        if METRIKK is not None:
+            METRIKK.steg("fetch")
+
+        for kilde, ics_text in feeds:
+            kilde_events.extend(kilde_events_fra_ics(ics_text, kilde))
+        if METRIKK is not None:
+            METRIKK.steg("parse")
+
+        if CONFIG["SNAPSHOT_ENABLED"]:
+            lagre_snapshot(feeds, kilde_events)
+            if METRIKK is not None:
+                METRIKK.steg("snapshot")
 
     report: List[ReportItem] = []
 
@@ -925,58 +3444,152 @@ def main() -> None:
 
     # Til konfliktsjekk (tvers av alle output-kalendere)
     all_output_events_for_conflicts: List[OutputEventForConflicts] = []
+    # Serier (RRULE) utvides først når konfliktsjekk/opptatt-kalender trenger dem
+    serier_for_conflicts: List[Tuple[OutputEventForConflicts, UtEvent]] = []
+
+    # Output-kalendere (events skrives fortløpende; filene byttes inn til slutt)
+    publisering = OutputPublisering(
+        CONFIG["OUTPUT_MANIFEST_FILE"], CONFIG["OUTPUT_COMPRESS"])
+    # Serier i lokal tid skrives med TZID=; de kalenderne trenger en VTIMEZONE
+    vtimezone_for: Dict[str, str] = {}
+    lokale_serier = [ev for ev in kilde_events if ev.rrule and ev.tid_lokal]
+    if lokale_serier:
+        vtz = vtimezone_tekst(min(ev.begin for ev in lokale_serier))
+        for ev in lokale_serier:
+            fagkode = finn_fagkode(ev.name)
+            if fagkode is not None:
+                vtimezone_for[CONFIG["COURSES"][fagkode]["short"]] = vtz
+
+    # Store feeder: weekday/start_time/end_time for alle events på én gang
+    # (før output-filene åpnes, så en feil her ikke etterlater .tmp-filer)
+    tids_treff: List[Optional[FrozenSet[str]]] = [None] * len(kilde_events)
+    if CONFIG.get("ENABLE_EVENT_FILTERS", True) and bruk_vektorisert(len(kilde_events)):
+        filtre, tester = _aktive_filtre()
+        tids_treff = vektor_tidstreff(
+            kilde_events, filtre, kompilert=tester is FILTER_TESTER_KOMPILERT)
+
+    skriver = lag_kalender_skriver(CONFIG["DRY_RUN"], publisering, vtimezone_for)
+    horisont = HorisontIndeks() if CONFIG["HORIZON_WINDOWS"] else None
+    duplikater = (DuplikatIndeks()
+                  if CONFIG["DEDUP_ACROSS_FEEDS"] and CONFIG["EXTRA_ICS_FEEDS"] else None)
+    try:
+        for ev, ev_tids_treff in zip(kilde_events, tids_treff):
+            res = transformer_hendelse(
+                ev, report, filter_stats_by_id, duplikater, ev_tids_treff)
+            if res is None:
+                hoppet_over += 1
+                continue
 
-    for ev in kilde.events:
-        res = transformer_hendelse(ev, report, filter_stats_by_id)
-        if res is None:
-            hoppet_over += 1
-            continue
-
-        kort, ny_ev, conflict_ev = res
-        utkalendere[kort].events.add(ny_ev)
-        all_output_events_for_conflicts.append(conflict_ev)
-        beholdt += 1
-
-    # Fail fast: krev at regler med require_at_least_one_match traff minst én gang
-    if CONFIG["FAIL_FAST"] and CONFIG.get("ENABLE_EVENT_FILTERS", True):
-        for rid, st in filter_stats_by_id.items():
-            if st.require_at_least_one_match and st.matched == 0:
-                _die(
-                    f"FAIL_FAST: Filterregel '{rid}' krevde minst én match, men fant 0.\n"
-                    "Sjekk at rom/tid/weekday stemmer med TP, eller slå av regelen midlertidig."
-                )
-
-    # Konfliktdetektor (tvers av alle)
-    conflict_total = 0
-    conflict_samples: List[Tuple[OutputEventForConflicts,
-                                 OutputEventForConflicts]] = []
-    if CONFIG.get("CONFLICT_DETECTOR_ENABLED", True):
-        conflict_total, conflict_samples = finn_konflikter_pa_tvers(
-            all_output_events_for_conflicts,
-            show_max=CONFIG["CONFLICTS_SHOW_MAX"],
-        )
+            kort, ny_ev, conflict_ev = res
+            skriver.skriv(kort, ny_ev)
+            if horisont is not None:
+                horisont.legg_til(kort, ny_ev)
+            if ny_ev.rrule:
+                serier_for_conflicts.append((conflict_ev, ny_ev))
+            else:
+                all_output_events_for_conflicts.append(conflict_ev)
+            beholdt += 1
+
+        # Fail fast: krev at regler med require_at_least_one_match traff minst én gang
+        if CONFIG["FAIL_FAST"] and CONFIG.get("ENABLE_EVENT_FILTERS", True):
+            for rid, st in filter_stats_by_id.items():
+                if st.require_at_least_one_match and st.matched == 0:
+                    _die(
+                        f"FAIL_FAST: Filterregel '{rid}' krevde minst én match, men fant 0.\n"
+                        "Sjekk at rom/tid/weekday stemmer med TP, eller slå av regelen midlertidig."
+                    )
+        if METRIKK is not None:
+            METRIKK.steg("transform")
+
+        # Sorter én gang; både konfliktdetektor og opptatt-kalender går på samme liste
+        # (serier flettes inn lat av iter_output_forekomster)
+        all_output_events_for_conflicts.sort(key=lambda e: e.begin_local_dt)
+
+        # Konfliktdetektor (tvers av alle)
+        conflict_total = 0
+        conflict_samples: List[Tuple[OutputEventForConflicts,
+                                     OutputEventForConflicts]] = []
+        if CONFIG.get("CONFLICT_DETECTOR_ENABLED", True):
+            conflict_total, conflict_samples = finn_konflikter_valgt(
+                iter_output_forekomster(
+                    all_output_events_for_conflicts, serier_for_conflicts),
+                show_max=CONFIG["CONFLICTS_SHOW_MAX"],
+            )
+        if METRIKK is not None:
+            METRIKK.steg("conflicts")
 
-    # Tell per kalender
-    per_calendar_counts: Dict[str, int] = {k: 0 for k in utkalendere.keys()}
-    for short_code, cal in utkalendere.items():
-        per_calendar_counts[short_code] = len(cal.events)
+        # Rombelegg (egen runde over de samme sorterte forekomstene)
+        rom_indeks: Optional[RomIndeks] = None
+        if CONFIG["ROOM_REPORT"] or CONFIG["ROOM_FREE_QUERIES"]:
+            rom_indeks = RomIndeks()
+            for c in iter_output_forekomster(all_output_events_for_conflicts, serier_for_conflicts):
+                rom_indeks.legg_til(c)
+            rom_indeks.bygg()
 
-    print(f"Behandlet events: {beholdt} (hoppet over: {hoppet_over})")
+        # Tell per kalender
+        per_calendar_counts = skriver.antall_per_kalender()
 
-    # Skriv filer (med DRY_RUN toggle)
-    if CONFIG["DRY_RUN"]:
-        print("DRY RUN: skriver ingen .ics-filer.")
-    else:
-        print("Skriver .ics-filer …")
-        for fagkode, meta in CONFIG["COURSES"].items():
-            kort = meta["short"]
-            filnavn = meta["file"]
-            with open(filnavn, "w", encoding="utf-8", newline="\n") as f:
-                f.write(utkalendere[kort].serialize())
+        print(f"Behandlet events: {beholdt} (hoppet over: {hoppet_over})")
 
+        # Skriv filer (med DRY_RUN toggle)
+        if CONFIG["DRY_RUN"]:
+            print("DRY RUN: skriver ingen .ics-filer.")
+        else:
+            print("Skriver .ics-filer …")
+            skriver.fullfor()
+    except BaseException:
+        # Også feil etter løkka (f.eks. ugyldig RRULE i konfliktsjekken) skal
+        # lukke åpne filer og fjerne .tmp-filene
+        skriver.avbryt()
+        raise
+
+    if not CONFIG["DRY_RUN"]:
         print("Filer skrevet:")
         for fagkode, meta in CONFIG["COURSES"].items():
-            print(f" - {meta['file']}   (fag {fagkode} -> {meta['short']})")
+            uendret = publisering.status.get(meta["file"]) == "uendret"
+            print(f" - {meta['file']}   (fag {fagkode} -> {meta['short']})"
+                  + ("   [uendret, ikke skrevet på nytt]" if uendret else ""))
+
+    if CONFIG["FREEBUSY_FILE"]:
+        blokker = slaa_sammen_opptatt(iter_output_forekomster(
+            all_output_events_for_conflicts, serier_for_conflicts))
+        if not CONFIG["DRY_RUN"]:
+            skriv_kalenderfil(CONFIG["FREEBUSY_FILE"],
+                              opptatt_events(blokker), publisering)
+        print(
+            f"Opptatt-kalender: {CONFIG['FREEBUSY_FILE']}   ({len(blokker)} blokker)"
+            + (" (DRY RUN, ikke skrevet)" if CONFIG["DRY_RUN"] else ""))
+
+    if horisont is not None:
+        horisont_filer = skriv_horisont_filer(
+            horisont, naa_utc(), CONFIG["DRY_RUN"], publisering)
+        print("Horisont-filer" + (" (DRY RUN, ikke skrevet):" if CONFIG["DRY_RUN"] else ":"))
+        for filnavn, antall in horisont_filer:
+            print(f" - {filnavn}   ({antall} events)")
+
+    if not CONFIG["DRY_RUN"]:
+        publisering.lagre_manifest()
+    if METRIKK is not None:
+        METRIKK.steg("write")
+        METRIKK.sett("events", len(kilde_events), outcome="seen")
+        METRIKK.sett("events", beholdt, outcome="kept")
+        METRIKK.sett("events", sum(1 for r in report
+                                   if r.flags.filtered_out and not r.flags.occurrence),
+                     outcome="filtered")
+        METRIKK.sett("occurrences", sum(1 for r in report if r.flags.occurrence),
+                     outcome="filtered")
+        METRIKK.sett("events", sum(1 for r in report if r.course_code is None),
+                     outcome="unmatched")
+        METRIKK.sett("events", sum(1 for r in report if r.flags.duplicate),
+                     outcome="duplicate")
+        for rid, st in filter_stats_by_id.items():
+            METRIKK.sett("filter_rule_matches", st.matched, rule=rid)
+            METRIKK.sett("filter_rule_removed", st.removed, rule=rid)
+        METRIKK.sett("conflicts", conflict_total)
+        for status in ("skrevet", "uendret"):
+            METRIKK.sett("output_files",
+                         sum(1 for v in publisering.status.values() if v == status),
+                         status=status)
 
     # Rapport til slutt
     print_report(
@@ -986,6 +3599,8 @@ def main() -> None:
         conflict_samples=conflict_samples,
         per_calendar_counts=per_calendar_counts,
         dry_run=CONFIG["DRY_RUN"],
+        duplicates_by_source=duplikater.per_kilde if duplikater is not None else None,
+        rom=rom_indeks,
     )
 
 